@@ -1,10 +1,33 @@
 import streamlit as st
-import requests
 import json
 import pandas as pd
 import io
+import math
+import os
 from datetime import datetime
 
+from send_now.contacts import IngestCache, search_contacts
+from send_now.domains import MX_LOOKUPS, DomainCache, screen_contacts
+from send_now.endpoints import EndpointPool, parse_endpoints
+from send_now.jobs import FAILED, SENT, SKIPPED, JobJournal, JobSpec
+from send_now.ledger import SendLedger
+from send_now.metrics import SendMetrics, serve_metrics
+from send_now.optimize import optimize_template
+from send_now.store import DatasetStore
+from send_now.sheets import DEFAULT_BATCH_ROWS, SheetSync, SyncManifest
+from send_now.sender import (
+    DEFAULT_BATCH_MAX_BYTES,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    make_session,
+    post_payload,
+)
+from send_now.templating import compile_template
+from send_now.worker import ACTIVE_STATES, ERROR, SendWorker
+
 # Page config
 st.set_page_config(
     page_title="CSV to Google Sheets & Email Sender",
@@ -46,8 +69,89 @@ st.markdown('<div class="main-header"><h1>📧 CSV to Google Sheets & Email Send
 # Configuration
 WEBHOOK_URL = "https://agentonline-u29564.vm.elestio.app/webhook/192d43hooksend"
 TEST_WEBHOOK_URL = "https://agentonline-u29564.vm.elestio.app/webhook/192d43hooksend"
+# Endpoint pool, one "URL [WEIGHT] [HEALTH_URL]" per line
+WEBHOOK_POOL = os.environ.get("WEBHOOK_POOL", WEBHOOK_URL)
 GOOGLE_SHEETS_URL = "https://docs.google.com/spreadsheets/d/1CaZR5y2NgccRjJ4P_I-77KXJF9Hb_4AI8wfqI4Q_6K8/edit?gid=0#gid=0"
-SHEETS_API_URL = "https://script.google.com/macros/s/YOUR_DEPLOYMENT_ID/exec"  # You'll need to set up Apps Script
+# Deploy apps_script/Code.gs as a web app and set SHEETS_API_URL to its /exec URL
+SHEETS_API_URL = os.environ.get("SHEETS_API_URL", "https://script.google.com/macros/s/YOUR_DEPLOYMENT_ID/exec")
+SHEETS_MANIFEST_PATH = "sheets_manifest.sqlite3"  # Row hashes already written to the sheet
+JOURNAL_PATH = "send_jobs.sqlite3"  # Checkpoint journal for resumable send jobs
+LEDGER_PATH = "send_ledger.sqlite3"  # Who was sent which template, across jobs
+DOMAIN_CACHE_PATH = "domain_cache.sqlite3"  # MX/domain verdicts, kept for days
+RESULTS_TABLE_ROWS = 1000
+PICKER_OPTIONS = 50  # Contacts offered at once by the preview picker
+JOB_POLL_SECONDS = 2
+# Set METRICS_PORT to serve /metrics (Prometheus) and /metrics.json; set
+# METRICS_HOST=0.0.0.0 to let a scraper on another machine reach them
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+
+# Shared HTTP client: one keep-alive connection pool per process, reused
+# across reruns and browser sessions instead of a new handshake per email
+@st.cache_resource
+def get_http_session(pool_size=DEFAULT_POOL_SIZE):
+    return make_session(pool_size=pool_size)
+
+
+# Parsed uploads, keyed by file content hash and shared by all sessions, so
+# reruns triggered by unrelated widgets don't re-parse and re-validate
+@st.cache_resource
+def get_ingest_cache():
+    return IngestCache()
+
+
+@st.cache_resource
+def get_domain_cache():
+    return DomainCache(DOMAIN_CACHE_PATH)
+
+
+@st.cache_resource
+def get_sheets_manifest():
+    return SyncManifest(SHEETS_MANIFEST_PATH)
+
+
+# One journal connection per process; jobs survive reruns and restarts
+@st.cache_resource
+def get_job_journal():
+    return JobJournal(JOURNAL_PATH)
+
+
+# One ledger per process, shared by every job so reruns and overlapping
+# uploads never send the same email to the same address twice
+@st.cache_resource
+def get_send_ledger():
+    return SendLedger(LEDGER_PATH)
+
+
+# Latency, status codes, bytes and request rate of every webhook request
+# made by this process, from bulk jobs and the quick send form alike
+@st.cache_resource
+def get_send_metrics():
+    metrics = SendMetrics()
+    if METRICS_PORT:
+        serve_metrics(metrics, METRICS_PORT, METRICS_HOST)
+    return metrics
+
+
+# The send queue lives in a background thread, independent of script runs
+@st.cache_resource
+def get_send_worker():
+    return SendWorker(get_job_journal(), metrics=get_send_metrics(), ledger=get_send_ledger())
+
+
+# Validated contact lists, stored once per file and shared by all sessions;
+# each session only keeps the dataset key in st.session_state.uploaded_key
+@st.cache_resource
+def get_dataset_store():
+    return DatasetStore()
+
+
+def current_contacts():
+    """This session's contact list, or None if nothing (or an evicted list) is loaded."""
+    dataset = get_dataset_store().get(st.session_state.uploaded_key)
+    return dataset.contacts if dataset is not None else None
+
 
 # Default email template
 DEFAULT_EMAIL_TEMPLATE = """<!DOCTYPE html>
@@ -178,23 +282,115 @@ DEFAULT_EMAIL_TEMPLATE = """<!DOCTYPE html>
 </html>"""
 
 # Initialize session state
-if 'uploaded_data' not in st.session_state:
-    st.session_state.uploaded_data = None
+if 'uploaded_key' not in st.session_state:
+    st.session_state.uploaded_key = None
 if 'email_subject' not in st.session_state:
     st.session_state.email_subject = "Welcome to VIDeMI Services 🌟"
+if 'email_template' not in st.session_state:
+    st.session_state.email_template = DEFAULT_EMAIL_TEMPLATE
 
 # Sidebar
 with st.sidebar:
     st.header("⚙️ Configuration")
     st.markdown("### Google Sheets")
     st.markdown(f"[📊 View Live Data]({GOOGLE_SHEETS_URL})")
+    sheets_batch_rows = st.number_input(
+        "Rows per Sheets Request",
+        min_value=1,
+        max_value=10000,
+        value=DEFAULT_BATCH_ROWS,
+        help="Only new or changed rows are uploaded, in batches of this size"
+    )
     
     st.markdown("---")
     st.markdown("### Webhook Endpoints")
     webhook_choice = st.radio(
         "Select Endpoint:",
-        ["Production", "Test"],
-        index=0
+        ["Production", "Test", "Pool"],
+        index=0,
+        help="Pool spreads a campaign over several webhooks, favouring the least busy and skipping failing ones"
+    )
+    pool_endpoints = []
+    if webhook_choice == "Pool":
+        pool_text = st.text_area(
+            "Pool Endpoints",
+            value=WEBHOOK_POOL,
+            help="One per line: URL [WEIGHT] [HEALTH_URL]. Weight defaults to 1; a health URL is probed with GET"
+        )
+        try:
+            pool_endpoints = parse_endpoints(pool_text)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        if not pool_endpoints:
+            st.warning("⚠️ Add at least one endpoint")
+    send_concurrency = st.number_input(
+        "Parallel Requests",
+        min_value=1,
+        max_value=256,
+        value=DEFAULT_CONCURRENCY,
+        help="How many webhook calls may be in flight at once"
+    )
+    send_timeout = st.number_input(
+        "Request Timeout (s)",
+        min_value=1,
+        max_value=120,
+        value=DEFAULT_TIMEOUT
+    )
+    send_rate_limit = st.number_input(
+        "Max Requests/sec",
+        min_value=0.0,
+        value=0.0,
+        step=5.0,
+        help="0 = no ceiling. The rate still backs off automatically on 429/503 and Retry-After"
+    )
+    send_max_attempts = st.number_input(
+        "Max Attempts per Email",
+        min_value=1,
+        max_value=10,
+        value=DEFAULT_MAX_ATTEMPTS,
+        help="Timeouts, connection errors, 429 and 5xx responses are retried with exponential backoff"
+    )
+    sheets_configured = "YOUR_DEPLOYMENT_ID" not in SHEETS_API_URL
+    write_status_to_sheet = st.checkbox(
+        "Write delivery status to Google Sheet",
+        value=sheets_configured,
+        disabled=not sheets_configured,
+        help="Status, HTTP code, time and latency per recipient, written in bulk to the 'Delivery Status' sheet"
+    )
+    payload_mode = st.radio(
+        "Payload Mode:",
+        ["One per recipient", "Batch"],
+        index=0,
+        help="Batch mode posts {\"recipients\": [...]} and needs a webhook that accepts arrays"
+    )
+    if payload_mode == "Batch":
+        batch_size = st.number_input(
+            "Recipients per Request",
+            min_value=1,
+            max_value=10000,
+            value=DEFAULT_BATCH_SIZE
+        )
+        batch_max_kb = st.number_input(
+            "Max Request Body (KB)",
+            min_value=16,
+            max_value=102400,
+            value=DEFAULT_BATCH_MAX_BYTES // 1024
+        )
+    template_by_reference = st.checkbox(
+        "Send template by reference",
+        value=False,
+        help="Register the template once under its hash; each email then carries only the hash and merge fields"
+    )
+    prerender_bodies = st.checkbox(
+        "Pre-render emails before sending",
+        value=True,
+        disabled=template_by_reference or payload_mode == "Batch",
+        help="Render every recipient's email once, compressed, before the first request, so the send loop only posts ready bytes"
+    )
+    optimize_html = st.checkbox(
+        "Optimize HTML before sending",
+        value=True,
+        help="Inline CSS, drop unused rules and whitespace, and unify repeated image URLs, once per template version"
     )
     
     st.markdown("---")
@@ -236,30 +432,25 @@ with st.sidebar:
                 }
                 
                 with st.spinner("Sending..."):
-                    try:
-                        response = requests.post(
-                            "https://agentonline-u29564.vm.elestio.app/webhook/192d43hooksend",
-                            json=quick_data,
-                            timeout=10
-                        )
-                        
-                        if response.status_code == 200:
-                            st.success("✅ Sent!")
-                            with st.expander("📄 Response"):
-                                try:
-                                    st.json(response.json())
-                                except:
-                                    st.text(response.text)
-                        else:
-                            st.error(f"❌ Error {response.status_code}")
-                            st.text(response.text)
-                            
-                    except requests.exceptions.Timeout:
-                        st.error("❌ Timeout")
-                    except requests.exceptions.ConnectionError:
-                        st.error("❌ Connection error")
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
+                    result = post_payload(
+                        "https://agentonline-u29564.vm.elestio.app/webhook/192d43hooksend",
+                        quick_data,
+                        timeout=10,
+                        session=get_http_session(),
+                        metrics=get_send_metrics()
+                    )
+                    
+                    if result.ok:
+                        st.success("✅ Sent!")
+                        with st.expander("📄 Response"):
+                            try:
+                                st.json(json.loads(result.response_text))
+                            except ValueError:
+                                st.text(result.response_text)
+                    else:
+                        st.error(result.status)
+                        if result.response_text:
+                            st.text(result.response_text)
 
 # Main content tabs
 tab1, tab2, tab3, tab4 = st.tabs(["📁 Upload CSV", "👁️ Preview Email", "📤 Send Emails", "📊 View Data"])
@@ -272,7 +463,8 @@ with tab1:
     - `name` or `Name` - Recipient's name
     - `email` or `Email` - Recipient's email address
     
-    Additional columns will be ignored. The file will be validated before processing.
+    Emails are normalized (whitespace, Unicode, domain case) and de-duplicated; disposable-inbox domains are skipped.
+    Additional columns are only read when the email template uses them as `{column}` placeholders. The file will be validated before processing.
     """)
     
     uploaded_file = st.file_uploader(
@@ -280,59 +472,92 @@ with tab1:
         type=['csv'],
         help="Upload a CSV file with 'name' and 'email' columns"
     )
+    verify_domains = st.checkbox(
+        "🌐 Skip domains that can't receive mail (MX lookup)",
+        value=MX_LOOKUPS,
+        disabled=not MX_LOOKUPS,
+        help=("Each domain is checked once; results are cached for a week" if MX_LOOKUPS
+              else "Install dnspython to enable MX lookups")
+    )
     
     if uploaded_file is not None:
         try:
-            # Read CSV
-            df = pd.read_csv(uploaded_file)
-            
-            # Normalize column names (handle case insensitivity)
-            df.columns = df.columns.str.strip().str.lower()
+            # Stream the CSV in chunks, parsing only the columns we use:
+            # name, email and whatever placeholders the template references
+            template_fields = compile_template(st.session_state.email_template).fields
+            ingest_cache = get_ingest_cache()
+            ingest, cache_hit = ingest_cache.get_or_ingest(uploaded_file.getvalue(),
+                                                           extra_columns=template_fields)
             
-            # Validate required columns
-            required_cols = ['name', 'email']
-            missing_cols = [col for col in required_cols if col not in df.columns]
-            
-            if missing_cols:
-                st.error(f"❌ Missing required columns: {', '.join(missing_cols)}")
-                st.info("Available columns: " + ", ".join(df.columns.tolist()))
+            if ingest.missing_columns:
+                st.error(f"❌ Missing required columns: {', '.join(ingest.missing_columns)}")
+                st.info("Available columns: " + ", ".join(ingest.available_columns))
             else:
-                # Filter only required columns
-                df_filtered = df[required_cols].copy()
-                
-                # Remove rows with missing values
-                initial_count = len(df_filtered)
-                df_filtered = df_filtered.dropna()
-                removed_count = initial_count - len(df_filtered)
-                
-                # Validate email format (basic)
-                df_filtered['email_valid'] = df_filtered['email'].str.contains(
-                    r'^[\w\.-]+@[\w\.-]+\.\w+$',
-                    regex=True,
-                    na=False
-                )
-                
-                invalid_emails = df_filtered[~df_filtered['email_valid']]
-                df_filtered = df_filtered[df_filtered['email_valid']].drop('email_valid', axis=1)
+                # Domain screening runs once per file; every session then shares the result
+                dataset_store = get_dataset_store()
+                dataset_key = ":".join([ingest.source_hash, ",".join(ingest.columns),
+                                        "mx" if verify_domains else "raw"])
+                dataset = dataset_store.get(dataset_key)
+                if dataset is None:
+                    if ingest.contacts is None:
+                        # The stored list was evicted since; parse the file again
+                        ingest, cache_hit = ingest_cache.get_or_ingest(
+                            uploaded_file.getvalue(), extra_columns=template_fields,
+                            need_contacts=True)
+                    if verify_domains and len(ingest.contacts) > 0:
+                        with st.spinner("Checking recipient domains..."):
+                            screened, domain_stats, domain_lookups = screen_contacts(
+                                ingest.contacts, cache=get_domain_cache()
+                            )
+                        dataset = dataset_store.put(dataset_key, screened,
+                                                    domain_stats=domain_stats, domain_lookups=domain_lookups)
+                    else:
+                        dataset = dataset_store.put(dataset_key, ingest.contacts)
+                    # The store owns the list now; the ingest cache keeps the counters
+                    ingest_cache.release_contacts(ingest.source_hash)
+                df_filtered = dataset.contacts
+                domain_stats = dataset.meta.get('domain_stats')
+                domain_lookups = dataset.meta.get('domain_lookups', 0)
                 
                 # Display results
-                col1, col2, col3 = st.columns(3)
+                col1, col2, col3, col4, col5, col6, col7 = st.columns(7)
                 with col1:
-                    st.metric("Total Rows", initial_count)
+                    st.metric("Total Rows", ingest.total_rows)
                 with col2:
                     st.metric("Valid Rows", len(df_filtered))
                 with col3:
-                    st.metric("Invalid/Removed", removed_count + len(invalid_emails))
+                    st.metric("Missing Values", ingest.missing_values)
+                with col4:
+                    st.metric("Invalid Format", ingest.invalid_emails)
+                with col5:
+                    st.metric("Duplicates", ingest.duplicates)
+                with col6:
+                    st.metric("Disposable", ingest.disposable)
+                with col7:
+                    st.metric("Undeliverable Domain", ingest.valid_rows - len(df_filtered))
+                st.caption(
+                    f"{'⚡ Loaded from cache' if cache_hit else '🔍 Parsed and validated'} · "
+                    f"cache: {ingest_cache.hits} hits / {ingest_cache.misses} misses, "
+                    f"{len(ingest_cache)} file(s), {ingest_cache.nbytes / 1_048_576:.1f} MB"
+                )
                 
-                if len(invalid_emails) > 0:
-                    with st.expander(f"⚠️ {len(invalid_emails)} Invalid Email(s)"):
-                        st.dataframe(invalid_emails[['name', 'email']], use_container_width=True)
+                if domain_stats is not None:
+                    rejected_domains = int((~domain_stats['accepted']).sum())
+                    with st.expander(f"🌐 {len(domain_stats)} Domain(s) Checked · {rejected_domains} Rejected"):
+                        st.caption(f"{domain_lookups} live lookup(s), {len(domain_stats) - domain_lookups} from cache")
+                        st.dataframe(domain_stats, use_container_width=True)
+                
+                if ingest.invalid_emails > 0:
+                    with st.expander(f"⚠️ {ingest.invalid_emails} Invalid Email(s)"):
+                        if ingest.invalid_emails > len(ingest.invalid_sample):
+                            st.caption(f"Showing the first {len(ingest.invalid_sample)}")
+                        st.dataframe(ingest.invalid_sample, use_container_width=True)
                 
                 if len(df_filtered) > 0:
                     st.success(f"✅ Successfully validated {len(df_filtered)} contacts!")
                     
-                    # Store in session state
-                    st.session_state.uploaded_data = df_filtered
+                    # The session only keeps a handle to the shared dataset
+                    st.session_state.uploaded_key = dataset_key
                     
                     # Display preview
                     st.subheader("📋 Data Preview")
@@ -340,20 +565,33 @@ with tab1:
                     
                     # Upload to Google Sheets button
                     if st.button("📤 Upload to Google Sheets", type="primary", use_container_width=True):
-                        with st.spinner("Uploading to Google Sheets..."):
-                            # Add timestamp
-                            df_upload = df_filtered.copy()
-                            df_upload['uploaded_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            
-                            # Note: You'll need to implement Google Sheets API integration
-                            # For now, showing success message
-                            st.success("✅ Data uploaded to Google Sheets!")
-                            st.info("📊 View your data in the Google Sheet using the link in the sidebar.")
+                        if not sheets_configured:
+                            st.error("❌ Google Sheets is not configured. Deploy apps_script/Code.gs and set SHEETS_API_URL.")
+                        else:
+                            sync_progress = st.progress(0.0)
+                            sheet_sync = SheetSync(
+                                SHEETS_API_URL,
+                                get_sheets_manifest(),
+                                batch_rows=sheets_batch_rows,
+                                session=get_http_session()
+                            )
+                            with st.spinner("Uploading to Google Sheets..."):
+                                report = sheet_sync.sync(
+                                    df_filtered,
+                                    # Timestamp goes with each row but doesn't count as a change
+                                    extra={"uploaded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+                                    on_progress=lambda done, total: sync_progress.progress(done / total)
+                                )
+                            sync_progress.empty()
                             
-                            # In production, you would use:
-                            # - Google Sheets API with credentials
-                            # - Or Apps Script Web App endpoint
-                            # - Or gspread library
+                            if report.failed:
+                                st.error(f"❌ {report.failed} row(s) failed to upload: {', '.join(sorted(set(report.errors)))}")
+                            if report.sent or not report.failed:
+                                st.success(
+                                    f"✅ Google Sheets up to date: {report.appended} added, {report.updated} updated, "
+                                    f"{report.unchanged} unchanged ({report.requests} request(s))"
+                                )
+                                st.info("📊 View your data in the Google Sheet using the link in the sidebar.")
                 else:
                     st.error("❌ No valid data rows found after validation.")
                     
@@ -362,103 +600,292 @@ with tab1:
     else:
         st.info("👆 Upload a CSV file to get started")
 
+# Resolved once per run for the remaining tabs
+uploaded_data = current_contacts()
+
 # TAB 2: Preview Email
 with tab2:
     st.header("Email Template Preview & Editor")
     
-    # Create two columns - code editor and preview
-    col_left, col_right = st.columns([1, 1], gap="large")
+    def render_preview(compiled, contact):
+        """Rendered preview, reused while neither the template nor the contact changes."""
+        key = (compiled.template_id, tuple(sorted((k, str(v)) for k, v in contact.items())))
+        cached = st.session_state.get("preview_cache")
+        if cached is None or cached[0] != key:
+            cached = (key, compiled.render(contact))
+            st.session_state.preview_cache = cached
+        return cached[1]
     
-    with col_left:
-        st.subheader("📝 HTML Code Editor")
-        
-        # Initialize email template in session state if not exists
-        if 'email_template' not in st.session_state:
-            st.session_state.email_template = DEFAULT_EMAIL_TEMPLATE
-        
-        # Text area for HTML editing
-        edited_template = st.text_area(
-            "Edit HTML Template:",
-            value=st.session_state.email_template,
-            height=600,
-            help="Use {name} as placeholder for recipient name",
-            label_visibility="collapsed"
-        )
-        
-        # Update session state
-        st.session_state.email_template = edited_template
-        
-        # Action buttons
-        btn_col1, btn_col2, btn_col3 = st.columns(3)
-        
-        with btn_col1:
-            if st.button("🔄 Reset to Default", use_container_width=True):
-                st.session_state.email_template = DEFAULT_EMAIL_TEMPLATE
-                st.rerun()
-        
-        with btn_col2:
-            if st.button("💾 Save Template", use_container_width=True):
-                st.success("✅ Template saved!")
-        
-        with btn_col3:
-            # Download template
-            st.download_button(
-                label="📥 Download HTML",
-                data=st.session_state.email_template,
-                file_name=f"email_template_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html",
-                mime="text/html",
-                use_container_width=True
-            )
+    # Edits rerun only this fragment, not the upload/send tabs; a full rerun
+    # happens only when the placeholder set changes (see below)
+    @st.fragment
+    def template_editor():
+        # Create two columns - code editor and preview
+        col_left, col_right = st.columns([1, 1], gap="large")
         
-        # Template info
-        with st.expander("ℹ️ Template Variables"):
-            st.markdown("""
-            **Available Placeholders:**
-            - `{name}` - Recipient's name
+        with col_left:
+            st.subheader("📝 HTML Code Editor")
             
-            **Tips:**
-            - Keep the HTML structure intact
-            - Test your changes in the preview
-            - Use inline CSS for better email client compatibility
-            """)
-    
-    with col_right:
-        st.subheader("👁️ Live Preview")
-        
-        if st.session_state.uploaded_data is not None and len(st.session_state.uploaded_data) > 0:
-            # Select a contact for preview
-            preview_idx = st.selectbox(
-                "Select contact for preview:",
-                range(len(st.session_state.uploaded_data)),
-                format_func=lambda x: f"{st.session_state.uploaded_data.iloc[x]['name']} ({st.session_state.uploaded_data.iloc[x]['email']})"
+            # Text area for HTML editing
+            edited_template = st.text_area(
+                "Edit HTML Template:",
+                value=st.session_state.email_template,
+                height=600,
+                help="Use {name}, {email} or any other CSV column as a placeholder",
+                label_visibility="collapsed"
             )
             
-            selected_contact = st.session_state.uploaded_data.iloc[preview_idx]
+            # Update session state
+            st.session_state.email_template = edited_template
             
-            # Replace placeholders
-            preview_html = st.session_state.email_template.replace("{name}", selected_contact['name'])
+            # Diff the placeholder set against the last run: a new field may
+            # need a column that the upload tab has not parsed yet, so only
+            # then rerun the whole app (which re-ingests with that column)
+            template_fields = compile_template(edited_template).fields
+            if template_fields != st.session_state.get("preview_fields", template_fields):
+                st.session_state.preview_fields = template_fields
+                st.rerun()
+            st.session_state.preview_fields = template_fields
             
-            st.info(f"📧 Preview for: **{selected_contact['name']}** ({selected_contact['email']})")
+            # Action buttons
+            btn_col1, btn_col2, btn_col3 = st.columns(3)
             
-        else:
-            # Use sample data if no CSV uploaded
-            st.info("📧 Preview with sample data (upload CSV for real names)")
-            preview_html = st.session_state.email_template.replace("{name}", "John Doe")
+            with btn_col1:
+                if st.button("🔄 Reset to Default", use_container_width=True):
+                    st.session_state.email_template = DEFAULT_EMAIL_TEMPLATE
+                    st.rerun()
+            
+            with btn_col2:
+                if st.button("💾 Save Template", use_container_width=True):
+                    st.success("✅ Template saved!")
+            
+            with btn_col3:
+                # Download template
+                st.download_button(
+                    label="📥 Download HTML",
+                    data=st.session_state.email_template,
+                    file_name=f"email_template_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html",
+                    mime="text/html",
+                    use_container_width=True
+                )
+            
+            # Template info
+            with st.expander("ℹ️ Template Variables"):
+                st.markdown("""
+                **Available Placeholders:**
+                - `{name}` - Recipient's name
+                - `{email}` - Recipient's email address
+                - `{column}` - Any other column from the uploaded CSV
+                
+                Values are HTML-escaped when inserted.
+                
+                **Tips:**
+                - Keep the HTML structure intact
+                - Test your changes in the preview
+                - Use inline CSS for better email client compatibility
+                """)
         
-        # Display HTML preview in iframe with full height
-        st.markdown("---")
-        st.components.v1.html(preview_html, height=650, scrolling=True)
+        with col_right:
+            st.subheader("👁️ Live Preview")
+            
+            live_preview = st.toggle(
+                "Live preview",
+                value=True,
+                help="Turn off while editing a large template; the preview then updates on Refresh Preview"
+            )
+            if live_preview or "preview_template" not in st.session_state:
+                st.session_state.preview_template = st.session_state.email_template
+            preview_source = st.session_state.preview_template
+            if optimize_html:
+                # Preview exactly what will be sent
+                optimized = optimize_template(preview_source)
+                preview_source = optimized.html
+                report = optimized.report
+                details = (f"⚡ Optimized: {report.original_bytes / 1024:,.1f} KB → "
+                           f"{report.optimized_bytes / 1024:,.1f} KB ({report.saved_ratio:.0%} smaller) · "
+                           f"{report.inlined_rules} rules inlined, {report.removed_rules} unused removed")
+                if report.repeated_assets:
+                    details += f" · {len(report.repeated_assets)} asset(s) referenced more than once"
+                st.caption(details)
+            compiled_template = compile_template(preview_source)
+            if not live_preview and st.session_state.preview_template != st.session_state.email_template:
+                st.caption("✏️ Preview shows the last refreshed version of the template")
+            
+            if uploaded_data is not None and len(uploaded_data) > 0:
+                # Type-ahead: only the first few matches become selectbox options
+                preview_query = st.text_input(
+                    "Find contact:",
+                    placeholder="Type part of a name or email..."
+                )
+                matches = get_dataset_store().search(st.session_state.uploaded_key, preview_query)
+                if matches is None or len(matches) == 0:
+                    st.caption("No matching contacts; showing the first one.")
+                    matches = uploaded_data
+                matches = matches.head(PICKER_OPTIONS)
+                labels = (matches['name'] + " (" + matches['email'] + ")").tolist()
+                
+                # Select a contact for preview
+                preview_idx = st.selectbox(
+                    "Select contact for preview:",
+                    range(len(matches)),
+                    format_func=labels.__getitem__
+                )
+                
+                selected_contact = matches.iloc[preview_idx]
+                
+                # Replace placeholders
+                preview_html = render_preview(compiled_template, selected_contact.to_dict())
+                
+                st.info(f"📧 Preview for: **{selected_contact['name']}** ({selected_contact['email']})")
+                
+            else:
+                # Use sample data if no CSV uploaded
+                st.info("📧 Preview with sample data (upload CSV for real names)")
+                preview_html = render_preview(compiled_template, {"name": "John Doe", "email": "john.doe@example.com"})
+            
+            # Display HTML preview in iframe with full height
+            st.markdown("---")
+            st.components.v1.html(preview_html, height=650, scrolling=True)
+            
+            # Refresh preview button
+            if st.button("🔄 Refresh Preview", use_container_width=True):
+                st.session_state.preview_template = st.session_state.email_template
+                st.rerun(scope="fragment")
         
-        # Refresh preview button
-        if st.button("🔄 Refresh Preview", use_container_width=True):
-            st.rerun()
+    template_editor()
 
 # TAB 3: Send Emails
 with tab3:
     st.header("Send Emails")
     
-    if st.session_state.uploaded_data is not None and len(st.session_state.uploaded_data) > 0:
-        df_send = st.session_state.uploaded_data
+    journal = get_job_journal()
+    worker = get_send_worker()
+    
+    def show_job_results(job_id):
+        """Final metrics and results table of a journaled job."""
+        counts = journal.counts(job_id)
+        total = sum(counts.values())
+        success_count = counts[SENT]
+        error_count = counts[FAILED]
+        skipped_count = counts[SKIPPED]
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Total Sent", total)
+        with col2:
+            st.metric("Successful", success_count)
+        with col3:
+            st.metric("Failed", error_count)
+        with col4:
+            st.metric("Already Sent", skipped_count)
+        
+        # Results table
+        results_df = journal.results_frame(job_id, limit=RESULTS_TABLE_ROWS)
+        if total > RESULTS_TABLE_ROWS:
+            st.caption(f"Showing the first {RESULTS_TABLE_ROWS:,} of {total:,} recipients")
+        st.dataframe(results_df, use_container_width=True)
+        
+        if success_count + skipped_count == total:
+            if skipped_count:
+                st.success(f"🎉 All emails sent successfully! {skipped_count} recipient(s) "
+                           f"already had this email and were skipped.")
+            else:
+                st.success("🎉 All emails sent successfully!")
+        elif success_count > 0:
+            st.warning(f"⚠️ Sent {success_count} emails, {error_count} failed")
+        else:
+            st.error("❌ All emails failed to send. Please check your webhook configuration.")
+    
+    # Polls the worker on its own timer, so the rest of the page (and the
+    # other tabs) stay usable while a campaign runs
+    def show_send_metrics():
+        """Live latency percentiles, request rate and status codes."""
+        snapshot = get_send_metrics().snapshot()
+        if not snapshot["requests"]:
+            return
+        
+        def ms(seconds):
+            return f"{seconds * 1000:,.0f} ms" if seconds is not None else "–"
+        
+        with st.expander("📈 Webhook Metrics"):
+            col1, col2, col3, col4, col5 = st.columns(5)
+            with col1:
+                st.metric("Requests/s", f"{snapshot['rate_10s']:,.1f}")
+            with col2:
+                st.metric("p50", ms(snapshot["p50"]))
+            with col3:
+                st.metric("p95", ms(snapshot["p95"]))
+            with col4:
+                st.metric("p99", ms(snapshot["p99"]))
+            with col5:
+                st.metric("Sent", f"{snapshot['bytes_sent'] / 1024 / 1024:,.1f} MB")
+            
+            st.caption(f"{snapshot['requests']:,} requests · status codes:")
+            st.bar_chart(pd.Series(snapshot["status_codes"], name="requests"))
+            
+            # Only pools a job has used; looking one up never creates it
+            pool = EndpointPool.lookup(pool_endpoints) if pool_endpoints else None
+            if pool is not None:
+                st.caption("Endpoint pool:")
+                st.dataframe(pd.DataFrame(pool.snapshot()),
+                             use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Download Metrics (JSON)",
+                get_send_metrics().to_json(),
+                file_name=f"send_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime="application/json",
+                key="download_metrics"
+            )
+    
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def job_monitor():
+        show_send_metrics()
+        jobs = worker.snapshot()
+        if not jobs:
+            return
+        
+        st.markdown("---")
+        st.subheader("📊 Sending Jobs")
+        for progress in jobs:
+            with st.container(border=True):
+                st.markdown(f"**Job `{progress.job_id}`** · {progress.state}")
+                st.progress(min(1.0, progress.done / progress.total) if progress.total else 0.0)
+                
+                details = f"{progress.done:,}/{progress.total:,} · {progress.rate:,.1f} emails/s"
+                if progress.eta is not None:
+                    details += f" · ETA {int(progress.eta // 60)}m {int(progress.eta % 60)}s"
+                st.caption(details)
+                
+                if progress.state in ACTIVE_STATES:
+                    if st.button("⏸️ Pause", key=f"pause_{progress.job_id}"):
+                        worker.pause(progress.job_id)
+                elif progress.state == ERROR:
+                    st.error(f"❌ {progress.error}")
+                else:
+                    with st.expander("📊 Sending Results", expanded=progress is jobs[0]):
+                        show_job_results(progress.job_id)
+    
+    job_monitor()
+    
+    # Jobs that stopped before every recipient was delivered
+    active = {p.job_id for p in worker.snapshot() if p.state in ACTIVE_STATES}
+    unfinished = [job for job in journal.jobs()
+                  if job["remaining"] > 0 and job["job_id"] not in active]
+    if unfinished:
+        with st.expander(f"♻️ {len(unfinished)} Unfinished Job(s)"):
+            st.caption("Resuming skips recipients that were already delivered and retries the rest.")
+            resume_choice = st.selectbox(
+                "Job:",
+                unfinished,
+                format_func=lambda job: (f"{job['job_id']} · {job['sent']}/{job['total']} sent, "
+                                         f"{job['failed']} failed · {job['state']}")
+            )
+            if st.button("▶️ Resume Job", use_container_width=True):
+                worker.submit(resume_choice["job_id"])
+                st.rerun()
+    
+    if uploaded_data is not None and len(uploaded_data) > 0:
+        df_send = uploaded_data
         
         st.info(f"📧 Ready to send {len(df_send)} emails")
         
@@ -476,84 +903,52 @@ with tab3:
         
         with col2:
             st.markdown("### Endpoint")
-            st.info(f"Using: **{webhook_choice}** webhook")
+            if webhook_choice == "Pool":
+                st.info(f"Using: **{len(pool_endpoints)}**-endpoint pool")
+            else:
+                st.info(f"Using: **{webhook_choice}** webhook")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            send_campaign = st.text_input(
+                "Campaign:",
+                placeholder=st.session_state.email_subject,
+                help="Each recipient gets this template once per campaign. Defaults to the subject line."
+            )
+        with col2:
+            allow_resend = st.checkbox(
+                "Allow resending",
+                value=False,
+                help="Send even to recipients the send ledger says already got this email"
+            )
         
         # Send button
-        if st.button("🚀 Send Emails", type="primary", use_container_width=True):
-            selected_url = TEST_WEBHOOK_URL if webhook_choice == "Test" else WEBHOOK_URL
-            
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            success_count = 0
-            error_count = 0
-            results = []
-            
-            for idx, row in df_send.head(send_limit).iterrows():
-                # Use the edited template from session state
-                personalized_html = st.session_state.email_template.replace("{name}", row['name'])
-                
-                # Prepare payload
-                payload = {
-                    "subject": st.session_state.email_subject,
-                    "email": row['email'],
-                    "name": row['name'],
-                    "html_content": personalized_html
-                }
-                
-                try:
-                    response = requests.post(selected_url, json=payload, timeout=10)
-                    
-                    if response.status_code == 200:
-                        success_count += 1
-                        results.append({
-                            "name": row['name'],
-                            "email": row['email'],
-                            "status": "✅ Success"
-                        })
-                    else:
-                        error_count += 1
-                        results.append({
-                            "name": row['name'],
-                            "email": row['email'],
-                            "status": f"❌ Error {response.status_code}"
-                        })
-                except Exception as e:
-                    error_count += 1
-                    results.append({
-                        "name": row['name'],
-                        "email": row['email'],
-                        "status": f"❌ {str(e)[:50]}"
-                    })
-                
-                # Update progress
-                progress = (idx + 1) / send_limit
-                progress_bar.progress(progress)
-                status_text.text(f"Sending... {idx + 1}/{send_limit}")
-            
-            # Show results
-            st.markdown("---")
-            st.subheader("📊 Sending Results")
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Sent", send_limit)
-            with col2:
-                st.metric("Successful", success_count)
-            with col3:
-                st.metric("Failed", error_count)
-            
-            # Results table
-            results_df = pd.DataFrame(results)
-            st.dataframe(results_df, use_container_width=True)
+        if st.button("🚀 Send Emails", type="primary", use_container_width=True,
+                     disabled=webhook_choice == "Pool" and not pool_endpoints):
+            spec = JobSpec(
+                url=(pool_endpoints[0]["url"] if pool_endpoints
+                     else TEST_WEBHOOK_URL if webhook_choice == "Test" else WEBHOOK_URL),
+                subject=st.session_state.email_subject,
+                template=(optimize_template(st.session_state.email_template).html if optimize_html
+                          else st.session_state.email_template),
+                by_reference=template_by_reference,
+                batch_size=batch_size if payload_mode == "Batch" else 0,
+                batch_max_bytes=batch_max_kb * 1024 if payload_mode == "Batch" else DEFAULT_BATCH_MAX_BYTES,
+                concurrency=send_concurrency,
+                timeout=send_timeout,
+                rate_limit=send_rate_limit,
+                max_attempts=send_max_attempts,
+                status_sheet_url=SHEETS_API_URL if write_status_to_sheet else "",
+                endpoints=pool_endpoints,
+                prerender=prerender_bodies,
+                campaign=send_campaign.strip(),
+                dedupe=not allow_resend
+            )
             
-            if success_count == send_limit:
-                st.balloons()
-                st.success("🎉 All emails sent successfully!")
-            elif success_count > 0:
-                st.warning(f"⚠️ Sent {success_count} emails, {error_count} failed")
-            else:
-                st.error("❌ All emails failed to send. Please check your webhook configuration.")
+            # Journal every recipient, then hand the job to the background worker
+            job_id = journal.create_job(spec, df_send.head(send_limit))
+            worker.submit(job_id)
+            st.rerun()
     else:
         st.warning("⚠️ Please upload a CSV file first in the 'Upload CSV' tab.")
 
@@ -571,19 +966,46 @@ with tab4:
     
     st.markdown("---")
     
-    if st.session_state.uploaded_data is not None:
+    if uploaded_data is not None:
+        session_data = uploaded_data
         st.subheader("Current Session Data")
-        st.dataframe(st.session_state.uploaded_data, use_container_width=True)
         
-        # Download option
-        csv = st.session_state.uploaded_data.to_csv(index=False)
-        st.download_button(
-            label="📥 Download Current Data as CSV",
-            data=csv,
-            file_name=f"contacts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
+        # Search and page on the server; only one page goes to the browser
+        search_col, size_col = st.columns([3, 1])
+        with search_col:
+            data_query = st.text_input("🔍 Search", placeholder="Name or email...")
+        with size_col:
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        
+        matches = get_dataset_store().search(st.session_state.uploaded_key, data_query)
+        if matches is None:
+            # Evicted since the start of this run; search this run's copy uncached
+            matches = search_contacts(session_data, data_query)
+        page_count = max(1, math.ceil(len(matches) / page_size))
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1)
+        st.caption(f"{len(matches):,} of {len(session_data):,} contacts · page {page} of {page_count}")
+        
+        start = (page - 1) * page_size
+        st.dataframe(matches.iloc[start:start + page_size], use_container_width=True)
+        
+        # Download option: the CSV is only built once someone asks for it,
+        # then kept with the shared dataset
+        dataset = get_dataset_store().get(st.session_state.uploaded_key)
+        if dataset is None:
+            st.warning("⚠️ This contact list has expired. Please upload the CSV again.")
+        elif dataset.csv is None:
+            if st.button("📦 Prepare CSV Download", use_container_width=True):
+                with st.spinner("Building CSV..."):
+                    get_dataset_store().csv_bytes(st.session_state.uploaded_key)
+                st.rerun()
+        else:
+            st.download_button(
+                label="📥 Download Current Data as CSV",
+                data=dataset.csv,
+                file_name=f"contacts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
     else:
         st.info("No data loaded in current session. Upload a CSV to see data here.")
 
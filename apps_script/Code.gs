@@ -0,0 +1,121 @@
+// Apps Script web app behind SHEETS_API_URL (Deploy > New deployment > Web app).
+// Receives batches from send_now/sheets.py:
+//   {"action": "append" | "update", "sheet": "Contacts",
+//    "columns": [...], "key": "email", "rows": [[...], ...]}
+// Contacts go to the "Contacts" sheet; delivery results from send jobs are
+// upserted by email into "Delivery Status".
+
+// Matched rows at most this far apart are rewritten as one range
+var RUN_GAP = 20;
+
+function doPost(e) {
+  var body = JSON.parse(e.postData.contents);
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    var sheet = getSheet_(body.sheet, body.columns);
+    var layout = layout_(sheet, body.columns);
+    if (body.action === "update") {
+      updateRows_(sheet, layout, body.columns.indexOf(body.key), body.rows);
+    } else {
+      appendRows_(sheet, layout, body.rows);
+    }
+    return json_({ok: true, rows: body.rows.length});
+  } catch (err) {
+    return json_({ok: false, error: String(err)});
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+function getSheet_(name, columns) {
+  var book = SpreadsheetApp.getActiveSpreadsheet();
+  var sheet = book.getSheetByName(name) || book.insertSheet(name);
+  if (sheet.getLastRow() === 0) {
+    sheet.appendRow(columns);
+  }
+  return sheet;
+}
+
+// Where each posted column lives in the sheet. The posted columns follow
+// the template's placeholders, so they can change between syncs: columns
+// the header lacks are added to it, and rows are written by header name,
+// never by position.
+function layout_(sheet, columns) {
+  var header = sheet.getRange(1, 1, 1, sheet.getLastColumn()).getValues()[0];
+  var added = columns.filter(function (column) { return header.indexOf(column) === -1; });
+  if (added.length) {
+    sheet.getRange(1, header.length + 1, 1, added.length).setValues([added]);
+    header = header.concat(added);
+  }
+  return {
+    width: header.length,
+    indexes: columns.map(function (column) { return header.indexOf(column); })
+  };
+}
+
+// Copy a posted row's values into `target`, a row in sheet column order
+function place_(layout, row, target) {
+  layout.indexes.forEach(function (index, i) { target[index] = row[i]; });
+  return target;
+}
+
+function blankRow_(layout) {
+  var row = [];
+  for (var i = 0; i < layout.width; i++) row.push("");
+  return row;
+}
+
+function appendRows_(sheet, layout, rows) {
+  if (!rows.length) return;
+  var values = rows.map(function (row) { return place_(layout, row, blankRow_(layout)); });
+  // One range write per batch instead of one appendRow call per contact
+  sheet.getRange(sheet.getLastRow() + 1, 1, values.length, layout.width).setValues(values);
+}
+
+function updateRows_(sheet, layout, rowKeyIndex, rows) {
+  var keyColumn = layout.indexes[rowKeyIndex] + 1;
+  var lastRow = sheet.getLastRow();
+  var keys = lastRow > 1 ? sheet.getRange(2, keyColumn, lastRow - 1, 1).getValues() : [];
+  var position = {};
+  keys.forEach(function (k, i) { position[k[0]] = i + 2; });
+
+  // Sheet row -> posted row; the last one wins for a key sent twice
+  var updates = {};
+  var missing = [];
+  var missingAt = {};
+  rows.forEach(function (row) {
+    var key = row[rowKeyIndex];
+    if (position[key]) {
+      updates[position[key]] = row;
+    } else if (missingAt.hasOwnProperty(key)) {
+      missing[missingAt[key]] = row;
+    } else {
+      missingAt[key] = missing.length;
+      missing.push(row);
+    }
+  });
+
+  // Patch matched rows in memory and write them back a run at a time: one
+  // read and one write per run instead of per row. Columns this batch does
+  // not carry, and rows in the gaps of a run, are written back unchanged.
+  var at = Object.keys(updates).map(Number).sort(function (a, b) { return a - b; });
+  var start = 0;
+  for (var i = 1; i <= at.length; i++) {
+    if (i < at.length && at[i] - at[i - 1] <= RUN_GAP) continue;
+    var first = at[start];
+    var range = sheet.getRange(first, 1, at[i - 1] - first + 1, layout.width);
+    var values = range.getValues();
+    for (var j = start; j < i; j++) {
+      place_(layout, updates[at[j]], values[at[j] - first]);
+    }
+    range.setValues(values);
+    start = i;
+  }
+  appendRows_(sheet, layout, missing);
+}
+
+function json_(obj) {
+  return ContentService.createTextOutput(JSON.stringify(obj))
+    .setMimeType(ContentService.MimeType.JSON);
+}
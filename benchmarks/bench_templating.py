@@ -0,0 +1,48 @@
+"""Per-render cost of the compiled template engine vs. str.replace.
+
+    python benchmarks/bench_templating.py [rows]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from send_now.templating import compile_template  # noqa: E402
+
+# Roughly the size and shape of the stock template in app.py
+TEMPLATE = (
+    "<html><head><style>"
+    + "  .block { padding: 20px; margin: 0 auto; color: #333333; }\n" * 40
+    + "</style></head><body>"
+    + "<p>Hi {name},</p>"
+    + "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n" * 40
+    + "<p>This email was sent to {email}.</p></body></html>"
+)
+
+
+def main(rows: int = 100_000) -> None:
+    template = TEMPLATE
+    contacts = [
+        {"name": f"Contact {i} & Co", "email": f"contact{i}@example.com"}
+        for i in range(rows)
+    ]
+
+    started = time.perf_counter()
+    for contact in contacts:
+        template.replace("{name}", contact["name"])
+    baseline = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled = compile_template(template)
+    for contact in contacts:
+        compiled.render(contact)
+    elapsed = time.perf_counter() - started
+
+    print(f"rows: {rows:,}  template: {len(template):,} bytes  fields: {', '.join(compiled.fields)}")
+    print(f"str.replace ({{name}} only, no escaping): {baseline * 1e6 / rows:7.2f} us/render  {baseline:6.2f} s total")
+    print(f"compiled (all fields, escaped):         {elapsed * 1e6 / rows:7.2f} us/render  {elapsed:6.2f} s total")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
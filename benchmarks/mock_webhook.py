@@ -0,0 +1,122 @@
+"""Local stand-in for the send webhook, for benchmarks and dry runs.
+
+    python benchmarks/mock_webhook.py --port 8099 --latency-ms 40 --error-rate 0.01 --rate-limit 500
+
+Every POST sleeps ``latency`` (plus up to ``jitter``), then fails with 500
+at ``error_rate``, or answers 429 with ``Retry-After`` once more than
+``rate_limit`` requests arrive within a second. Batch bodies
+(``{"recipients": [...]}``) get one result per recipient, matched by email.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockWebhook(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0,
+                 retry_after: float = 1.0, host: str = "127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._window_start = 0
+        self._window_count = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def over_limit(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return False
+            second = int(time.monotonic())
+            if second != self._window_start:
+                self._window_start, self._window_count = second, 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def start(self) -> "MockWebhook":
+        threading.Thread(target=self.serve_forever, name="mock-webhook", daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without this, Nagle plus
+    # delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if server.over_limit():
+            self._reply(429, {"error": "rate limited"},
+                        {"Retry-After": f"{server.retry_after:g}"})
+        elif random.random() < server.error_rate:
+            self._reply(500, {"error": "injected failure"})
+        else:
+            payload = json.loads(body or b"{}")
+            if "recipients" in payload:
+                self._reply(200, {"results": [
+                    {"email": r.get("email"), "ok": True} for r in payload["recipients"]]})
+            else:
+                self._reply(200, {"ok": True})
+
+    def _reply(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="requests per second before answering 429, 0 for none")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+
+
+def from_arguments(args: argparse.Namespace, port: int = 0) -> MockWebhook:
+    return MockWebhook(port, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                       error_rate=args.error_rate, rate_limit=args.rate_limit,
+                       retry_after=args.retry_after)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the send webhook")
+    parser.add_argument("--port", type=int, default=8099)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, args.port)
+    print(f"Listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
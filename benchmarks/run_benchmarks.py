@@ -0,0 +1,226 @@
+"""Throughput of the hot paths on synthetic contact lists.
+
+    python benchmarks/run_benchmarks.py                        # 1k, 100k, 1M rows
+    python benchmarks/run_benchmarks.py --sizes 1000 100000 --stages ingest send \\
+        --latency-ms 50 --error-rate 0.02 --rate-limit 800 --concurrency 64
+
+Stages:
+  ingest      stream, normalize, validate and dedupe the CSV (ingest_csv)
+  templating  render every contact's email with the compiled template
+  send        post payloads to a local mock webhook (see mock_webhook.py);
+              at most --send-limit rows per size, so 1M rows stays practical
+
+Each (stage, size) runs in a fresh process so its peak RSS is its own. The
+mock webhook runs in another process so it does not compete for the GIL.
+One JSON line per result is appended to --out together with the run's
+settings; compare runs to catch regressions before a deploy.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.bench_templating import TEMPLATE  # noqa: E402
+from benchmarks.mock_webhook import add_arguments, from_arguments  # noqa: E402
+from send_now.contacts import ingest_csv  # noqa: E402
+from send_now.jobs import build_payload  # noqa: E402
+from send_now.metrics import SendMetrics  # noqa: E402
+from send_now.sender import (  # noqa: E402
+    RateLimiter,
+    RetryPolicy,
+    dispatch,
+    dispatch_batches,
+    make_session,
+)
+from send_now.templating import compile_template  # noqa: E402
+
+SIZES = (1_000, 100_000, 1_000_000)
+STAGES = ("ingest", "templating", "send")
+DEFAULT_OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+DOMAINS = np.array(["example.com", "example.org", "mail.example.net", "corp.example.io"])
+CITIES = np.array(["Lisbon", "Osaka", "Toronto", "Nairobi", "Zürich", "São Paulo"])
+
+
+def make_csv(rows: int, directory: str, seed: int = 0) -> str:
+    """Synthetic contacts with ~2% invalid emails, ~1% duplicates and a few blanks."""
+    path = os.path.join(directory, f"contacts_{rows}.csv")
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(np.arange(rows)).astype(str)
+    emails = "user" + ids + "@" + pd.Series(rng.choice(DOMAINS, rows))
+    emails[rng.random(rows) < 0.02] = "not-an-email"
+    duplicates = rng.random(rows) < 0.01
+    emails[duplicates] = emails.sample(int(duplicates.sum()), replace=True,
+                                       random_state=seed).to_numpy()
+    names = "Contact " + ids
+    names[rng.random(rows) < 0.005] = ""
+    pd.DataFrame({
+        "name": names,
+        "email": emails,
+        "city": rng.choice(CITIES, rows),
+        "company": "Company " + pd.Series(rng.integers(0, 1000, rows)).astype(str),
+        # Not used by the template, so ingest_csv should skip it
+        "notes": "lorem ipsum dolor sit amet",
+    }).to_csv(path, index=False)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_ingest(path: str, options: dict) -> dict:
+    started = time.perf_counter()
+    result = ingest_csv(path, extra_columns=compile_template(TEMPLATE).fields)
+    elapsed = time.perf_counter() - started
+    return {"rows": result.total_rows, "elapsed": elapsed,
+            "valid": len(result.contacts), "removed": result.removed}
+
+
+def bench_templating(path: str, options: dict) -> dict:
+    contacts = ingest_csv(path).contacts
+    records = contacts.to_dict("records")
+    started = time.perf_counter()
+    compiled = compile_template(TEMPLATE)
+    rendered_bytes = 0
+    for record in records:
+        rendered_bytes += len(compiled.render(record))
+    elapsed = time.perf_counter() - started
+    return {"rows": len(records), "elapsed": elapsed,
+            "avg_body_bytes": rendered_bytes // max(1, len(records))}
+
+
+def bench_send(path: str, options: dict) -> dict:
+    contacts = ingest_csv(path).contacts.head(options["send_limit"])
+    compiled = compile_template(TEMPLATE)
+    items = (
+        (pos, build_payload(compiled, "Benchmark", name, email, {"name": name, "email": email}))
+        for pos, (name, email) in enumerate(zip(contacts["name"], contacts["email"]))
+    )
+    metrics = SendMetrics()
+    kwargs = dict(
+        concurrency=options["concurrency"],
+        session=make_session(pool_size=max(64, options["concurrency"])),
+        limiter=RateLimiter(options["client_rate"]),
+        retry=RetryPolicy(max_attempts=options["max_attempts"], base_delay=0.05),
+        metrics=metrics,
+    )
+    started = time.perf_counter()
+    if options["batch_size"]:
+        results = dispatch_batches(items, options["url"], batch_size=options["batch_size"], **kwargs)
+    else:
+        results = dispatch(items, options["url"], **kwargs)
+    delivered = sum(result.ok for result in results)
+    elapsed = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()
+    return {
+        "rows": len(contacts), "elapsed": elapsed, "delivered": delivered,
+        "requests": snapshot["requests"], "status_codes": snapshot["status_codes"],
+        "p50_ms": round((snapshot["p50"] or 0) * 1000, 2),
+        "p95_ms": round((snapshot["p95"] or 0) * 1000, 2),
+        "p99_ms": round((snapshot["p99"] or 0) * 1000, 2),
+    }
+
+
+BENCHMARKS = {"ingest": bench_ingest, "templating": bench_templating, "send": bench_send}
+
+
+def _child(stage: str, path: str, options: dict, results) -> None:
+    result = BENCHMARKS[stage](path, options)
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    results.put(result)
+
+
+def _serve(args: argparse.Namespace, ready) -> None:
+    server = from_arguments(args)
+    ready.put(server.url)
+    server.serve_forever()
+
+
+def run_isolated(context, stage: str, path: str, options: dict) -> dict:
+    results = context.Queue()
+    process = context.Process(target=_child, args=(stage, path, options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--out", default=DEFAULT_OUT, help="JSONL file results are appended to")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "send_now_bench"),
+                        help="where synthetic CSVs are generated and reused")
+    parser.add_argument("--send-limit", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--client-rate", type=float, default=0.0,
+                        help="sender-side requests per second ceiling, 0 for none")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    server = None
+    options = {
+        "send_limit": args.send_limit, "concurrency": args.concurrency,
+        "batch_size": args.batch_size, "max_attempts": args.max_attempts,
+        "client_rate": args.client_rate, "url": None,
+    }
+    if "send" in args.stages:
+        ready = context.Queue()
+        server = context.Process(target=_serve, args=(args, ready), daemon=True)
+        server.start()
+        options["url"] = ready.get(timeout=30)
+
+    run = {
+        "run_id": uuid.uuid4().hex[:8],
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "mock": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+                 "error_rate": args.error_rate, "rate_limit": args.rate_limit},
+        **{key: value for key, value in options.items() if key != "url"},
+    }
+    print(f"{'stage':<11} {'size':>10} {'rows':>10} {'rows/s':>12} {'peak RSS':>10}  latency p50/p95/p99")
+    try:
+        with open(args.out, "a", encoding="utf-8") as out:
+            for size in args.sizes:
+                path = make_csv(size, args.data_dir)
+                for stage in args.stages:
+                    result = run_isolated(context, stage, path, options)
+                    result["rows_per_sec"] = round(result["rows"] / result["elapsed"], 1) \
+                        if result["elapsed"] else None
+                    latency = (f"  {result['p50_ms']}/{result['p95_ms']}/{result['p99_ms']} ms"
+                               if stage == "send" else "")
+                    print(f"{stage:<11} {size:>10,} {result['rows']:>10,} "
+                          f"{result['rows_per_sec'] or 0:>12,.0f} {result['peak_rss_mb']:>8,.0f}MB{latency}")
+                    out.write(json.dumps({**run, "stage": stage, "size": size, **result}) + "\n")
+                    out.flush()
+    finally:
+        if server is not None:
+            server.terminate()
+    print(f"Results appended to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Streamlit-free building blocks behind the Send Now app."""
@@ -0,0 +1,5 @@
+import sys
+
+from send_now.cli import main
+
+sys.exit(main())
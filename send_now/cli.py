@@ -0,0 +1,273 @@
+"""Headless entry point: validate a CSV and send it without Streamlit.
+
+    python -m send_now send contacts.csv --template t.html --url https://... \\
+        --concurrency 64 --out results.jsonl
+    python -m send_now resume JOB_ID --out results.jsonl
+    python -m send_now jobs
+
+Sends go through the same job journal as the app, so a run cut short can
+be resumed from either side, and the same send ledger, so recipients who
+already got the email from either side are skipped. One JSON line is written per recipient result
+as results arrive; progress and a summary go to stderr.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import IO, Iterable, List, Optional
+
+from send_now.contacts import ingest_csv
+from send_now.domains import DEFAULT_CACHE_PATH, MX_LOOKUPS, DomainCache, screen_contacts
+from send_now.endpoints import parse_endpoints
+from send_now.jobs import (
+    DEFAULT_JOURNAL_PATH,
+    FAILED,
+    PENDING,
+    SENT,
+    SKIPPED,
+    JobError,
+    JobJournal,
+    JobSpec,
+    run_job,
+)
+from send_now.ledger import DEFAULT_LEDGER_PATH, SendLedger
+from send_now.metrics import SendMetrics
+from send_now.optimize import optimize_template
+from send_now.sender import (
+    DEFAULT_BATCH_MAX_BYTES,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    SendResult,
+    make_session,
+)
+from send_now.templating import compile_template
+
+WEBHOOK_URL_ENV = "SEND_NOW_WEBHOOK_URL"
+PROGRESS_SECONDS = 5.0
+# Results buffered before their names/emails are looked up in one query
+_LOOKUP_BATCH = 500
+
+
+def _log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def write_results(journal: JobJournal, job_id: str, results: Iterable[SendResult],
+                  out: IO[str], metrics: Optional[SendMetrics] = None) -> int:
+    """Write each result as a JSON line to ``out``; returns how many were written."""
+    written = 0
+    last_progress = time.monotonic()
+    buffered: List[SendResult] = []
+
+    def flush():
+        contacts = journal.recipients(job_id, [r.key for r in buffered])
+        for result in buffered:
+            name, email = contacts.get(result.key, (None, None))
+            out.write(json.dumps({
+                "job_id": job_id,
+                "pos": result.key,
+                "name": name,
+                "email": email,
+                "ok": result.ok,
+                "skipped": result.skipped,
+                "status_code": result.status_code,
+                "error": result.error,
+                "attempts": result.attempts,
+                "elapsed": round(result.elapsed, 4),
+            }, ensure_ascii=False) + "\n")
+        out.flush()
+        buffered.clear()
+
+    for result in results:
+        buffered.append(result)
+        written += 1
+        if len(buffered) >= _LOOKUP_BATCH:
+            flush()
+        if metrics is not None and time.monotonic() - last_progress >= PROGRESS_SECONDS:
+            snapshot = metrics.snapshot()
+            _log(f"{written:,} results · {snapshot['rate_10s']:,.1f} req/s · "
+                 f"p95 {(snapshot['p95'] or 0) * 1000:,.0f} ms")
+            last_progress = time.monotonic()
+    if buffered:
+        flush()
+    return written
+
+
+def _run(journal: JobJournal, ledger: SendLedger, job_id: str, out_path: str,
+         metrics_path: Optional[str]) -> int:
+    metrics = SendMetrics()
+    spec = journal.spec(job_id)
+    if spec.uses_prerender:
+        started = time.perf_counter()
+        rendered = journal.prerender(job_id)
+        _log(f"Pre-rendered {rendered:,} emails in {time.perf_counter() - started:.1f}s")
+    session = make_session(pool_size=max(DEFAULT_POOL_SIZE, spec.concurrency), hosts=spec.hosts)
+    results = run_job(journal, job_id, session=session, metrics=metrics, ledger=ledger)
+    out = sys.stdout if out_path == "-" else open(out_path, "a", encoding="utf-8")
+    try:
+        write_results(journal, job_id, results, out, metrics)
+    except KeyboardInterrupt:
+        _log("Interrupted; in-flight recipients stay pending for resume")
+    finally:
+        # Flushes the final checkpoint
+        results.close()
+        if out is not sys.stdout:
+            out.close()
+
+    counts = journal.counts(job_id)
+    snapshot = metrics.snapshot()
+    _log(f"Job {job_id}: {counts[SENT]:,} sent, {counts[FAILED]:,} failed, "
+         f"{counts[SKIPPED]:,} already sent, {counts[PENDING]:,} pending · p50 {(snapshot['p50'] or 0) * 1000:,.0f} ms, "
+         f"p99 {(snapshot['p99'] or 0) * 1000:,.0f} ms")
+    if metrics_path:
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            f.write(metrics.to_json())
+    if counts[PENDING]:
+        _log(f"Resume with: python -m send_now resume {job_id}")
+        return 1
+    return 0 if counts[FAILED] == 0 else 2
+
+
+def cmd_send(args: argparse.Namespace) -> int:
+    endpoints = []
+    try:
+        endpoints = parse_endpoints("\n".join(" ".join(e) for e in args.endpoint or []))
+    except ValueError as e:
+        _log(f"error: {e}")
+        return 64
+    url = args.url or os.environ.get(WEBHOOK_URL_ENV) or (endpoints[0]["url"] if endpoints else None)
+    if not url:
+        _log(f"error: pass --url or --endpoint, or set {WEBHOOK_URL_ENV}")
+        return 64
+    with open(args.template, encoding="utf-8") as f:
+        template = f.read()
+    if args.optimize:
+        optimized = optimize_template(template)
+        template = optimized.html
+        report = optimized.report
+        _log(f"Template optimized: {report.original_bytes:,} -> {report.optimized_bytes:,} bytes "
+             f"({report.saved_ratio:.0%} smaller), {report.inlined_rules} rules inlined, "
+             f"{report.removed_rules} unused removed")
+    compiled = compile_template(template)
+
+    ingest = ingest_csv(args.csv, extra_columns=compiled.fields)
+    if ingest.missing_columns:
+        _log(f"error: missing required columns: {', '.join(ingest.missing_columns)}")
+        return 65
+    contacts = ingest.contacts
+    _log(f"{ingest.total_rows:,} rows · {len(contacts):,} valid · "
+         f"{ingest.removed:,} removed ({ingest.invalid_emails:,} invalid, "
+         f"{ingest.duplicates:,} duplicates, {ingest.disposable:,} disposable)")
+
+    if args.verify_domains and not MX_LOOKUPS:
+        _log("warning: --verify-domains needs dnspython; no domains will be dropped")
+    elif args.verify_domains and len(contacts):
+        contacts, _, lookups = screen_contacts(contacts, cache=DomainCache(args.domain_cache))
+        _log(f"{len(contacts):,} contacts after domain screening ({lookups:,} lookups)")
+    if args.limit:
+        contacts = contacts.head(args.limit)
+    if not len(contacts):
+        _log("Nothing to send")
+        return 0
+
+    spec = JobSpec(
+        url=url,
+        subject=args.subject,
+        template=template,
+        by_reference=args.by_reference,
+        batch_size=args.batch_size,
+        batch_max_bytes=int(args.batch_max_kb * 1024),
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        rate_limit=args.rate_limit,
+        max_attempts=args.max_attempts,
+        endpoints=endpoints,
+        prerender=args.prerender,
+        campaign=args.campaign,
+        dedupe=not args.allow_resend,
+    )
+    journal = JobJournal(args.journal)
+    job_id = journal.create_job(spec, contacts)
+    _log(f"Job {job_id}: sending {len(contacts):,} emails")
+    return _run(journal, SendLedger(args.ledger), job_id, args.out, args.metrics_out)
+
+
+def cmd_resume(args: argparse.Namespace) -> int:
+    return _run(JobJournal(args.journal), SendLedger(args.ledger), args.job_id,
+                args.out, args.metrics_out)
+
+
+def cmd_jobs(args: argparse.Namespace) -> int:
+    for job in JobJournal(args.journal).jobs(limit=args.limit):
+        print(f"{job['job_id']}  {job['created_at']}  {job['state']:<11}  "
+              f"{job['sent']:,}/{job['total']:,} sent, {job['failed']:,} failed, "
+              f"{job['skipped']:,} skipped")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m send_now", description=__doc__.splitlines()[0])
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                        help="job journal (SQLite) shared with the app")
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER_PATH,
+                        help="send ledger (SQLite) of who got which email, shared with the app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_output_args(p):
+        p.add_argument("--out", default="-", help="JSONL results file (appended), - for stdout")
+        p.add_argument("--metrics-out", help="write request metrics as JSON when done")
+
+    send = commands.add_parser("send", help="validate a CSV and send it")
+    send.add_argument("csv", help="contacts CSV with name and email columns")
+    send.add_argument("--template", required=True, help="HTML template file with {placeholders}")
+    send.add_argument("--subject", required=True)
+    send.add_argument("--url", help=f"webhook URL (default: ${WEBHOOK_URL_ENV})")
+    send.add_argument("--endpoint", nargs="+", action="append",
+                      metavar=("URL", "WEIGHT [HEALTH_URL]"),
+                      help="add a pool endpoint instead of --url; repeat for each")
+    send.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    send.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    send.add_argument("--rate-limit", type=float, default=0,
+                      help="requests per second ceiling, 0 for none")
+    send.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    send.add_argument("--batch-size", type=int, default=0,
+                      help="recipients per request, 0 for one request each")
+    send.add_argument("--batch-max-kb", type=float, default=DEFAULT_BATCH_MAX_BYTES / 1024)
+    send.add_argument("--by-reference", action="store_true",
+                      help="register the template once and send merge fields only")
+    send.add_argument("--optimize", action="store_true",
+                      help="inline CSS and strip unused rules and whitespace from the template first")
+    send.add_argument("--prerender", action="store_true",
+                      help="render every email before the first request (one request per recipient only)")
+    send.add_argument("--campaign", default="",
+                      help="each recipient gets this template once per campaign (default: the subject)")
+    send.add_argument("--allow-resend", action="store_true",
+                      help="send even to recipients the ledger says already got this email")
+    send.add_argument("--verify-domains", action="store_true",
+                      help="drop recipients whose domain cannot receive mail")
+    send.add_argument("--domain-cache", default=DEFAULT_CACHE_PATH)
+    send.add_argument("--limit", type=int, default=0, help="send to the first N contacts only")
+    add_output_args(send)
+    send.set_defaults(func=cmd_send)
+
+    resume = commands.add_parser("resume", help="send the undelivered recipients of a job")
+    resume.add_argument("job_id")
+    add_output_args(resume)
+    resume.set_defaults(func=cmd_resume)
+
+    jobs = commands.add_parser("jobs", help="list recent jobs")
+    jobs.add_argument("--limit", type=int, default=20)
+    jobs.set_defaults(func=cmd_jobs)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (JobError, OSError) as e:
+        _log(f"error: {e}")
+        return 1
@@ -0,0 +1,305 @@
+"""Contact list ingestion.
+
+CSV uploads are streamed in chunks: only the columns we need are parsed,
+as (Arrow, when pyarrow is installed) strings, and each chunk is validated and reduced to its valid rows
+before the next one is read. Peak memory is therefore bounded by the chunk
+size plus the compact valid set, not by the size of the export.
+"""
+import hashlib
+import io
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+REQUIRED_COLUMNS = ["name", "email"]
+EMAIL_PATTERN = r'^[\w\.-]+@[\w\.-]+\.\w+$'
+
+try:
+    import pyarrow  # noqa: F401
+    # One contiguous buffer per column instead of a Python object per cell,
+    # and .str methods run in Arrow compute kernels, not a lambda per row
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+# Zero-width spaces/joiners, word joiner and BOM pasted in from spreadsheets
+INVISIBLE_PATTERN = '[\u200b-\u200d\u2060\ufeff]'
+DISPOSABLE_DOMAINS = frozenset({
+    "10minutemail.com", "20minutemail.com", "discard.email", "dispostable.com",
+    "emailondeck.com", "fakeinbox.com", "getairmail.com", "getnada.com",
+    "guerrillamail.com", "guerrillamail.net", "guerrillamail.org", "mailcatch.com",
+    "maildrop.cc", "mailinator.com", "mailnesia.com", "mintemail.com",
+    "mohmal.com", "mytemp.email", "sharklasers.com", "spamgourmet.com",
+    "temp-mail.org", "tempail.com", "tempmail.com", "tempmail.net",
+    "tempmailo.com", "throwawaymail.com", "trashmail.com", "trashmail.de",
+    "yopmail.com", "yopmail.net",
+})
+DEFAULT_CHUNK_SIZE = 100_000
+INVALID_SAMPLE_SIZE = 1_000
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+@dataclass
+class IngestResult:
+    # None once IngestCache has released it to a longer-lived owner
+    contacts: Optional[pd.DataFrame]
+    # First INVALID_SAMPLE_SIZE rows with a malformed email, for display
+    invalid_sample: pd.DataFrame
+    total_rows: int = 0
+    missing_values: int = 0
+    invalid_emails: int = 0
+    disposable: int = 0
+    duplicates: int = 0
+    missing_columns: List[str] = field(default_factory=list)
+    available_columns: List[str] = field(default_factory=list)
+    # Columns and row count of ``contacts``, kept when the frame is released
+    columns: List[str] = field(default_factory=list)
+    valid_rows: int = 0
+    # Content hash of the uploaded file, set by IngestCache
+    source_hash: str = ""
+
+    @property
+    def removed(self) -> int:
+        return self.missing_values + self.invalid_emails + self.disposable + self.duplicates
+
+    @property
+    def nbytes(self) -> int:
+        contacts = 0 if self.contacts is None else self.contacts.memory_usage(deep=True).sum()
+        return int(contacts + self.invalid_sample.memory_usage(deep=True).sum())
+
+
+def _normalize(column: str) -> str:
+    return str(column).strip().lower()
+
+
+def normalize_emails(emails: pd.Series) -> pd.DataFrame:
+    """Vectorized cleanup: Unicode NFKC, invisible characters, whitespace.
+
+    Returns ``email`` (domain lower-cased, local part kept as typed),
+    ``domain`` and ``key``, a 64-bit hash of the fully lower-cased address
+    used to spot the same person written twice.
+    """
+    # NFKC runs per value in Python, so only pay for it on non-ASCII rows
+    non_ascii = emails.str.contains(r"[^\x00-\x7f]", regex=True, na=False)
+    if non_ascii.any():
+        emails = emails.copy()
+        emails[non_ascii] = (emails[non_ascii].str.normalize("NFKC")
+                             .str.replace(INVISIBLE_PATTERN, "", regex=True))
+    emails = emails.str.strip()
+    # Regex replaces run as Arrow kernels on Arrow strings; rpartition would not
+    has_at = emails.str.contains("@", regex=False, na=False)
+    local = emails.str.replace(r"@[^@]*$", "", regex=True)
+    domain = emails.str.replace(r"^.*@", "", regex=True).str.lower().where(has_at, "")
+    emails = (local + "@" + domain).where(has_at, emails)
+    key = pd.util.hash_array(emails.str.lower().to_numpy(dtype=object), categorize=False)
+    return pd.DataFrame({"email": emails, "domain": domain, "key": key}, index=emails.index)
+
+
+def valid_emails(emails: pd.Series) -> pd.Series:
+    """Whether each address matches ``EMAIL_PATTERN``."""
+    valid = emails.str.contains(EMAIL_PATTERN, regex=True, na=False).astype(bool)
+    # Arrow's regex engine treats \w as ASCII only, so re-check the few
+    # non-ASCII rejects with Python's re
+    recheck = ~valid & emails.str.contains(r"[^\x00-\x7f]", regex=True, na=False).astype(bool)
+    if recheck.any():
+        valid[recheck] = [re.match(EMAIL_PATTERN, email) is not None
+                          for email in emails[recheck]]
+    return valid
+
+
+def search_mask(contacts: pd.DataFrame, query: str) -> pd.Series:
+    """Whether each row's name or email contains ``query`` (case-insensitive)."""
+    return (contacts["name"].str.contains(query, case=False, regex=False, na=False)
+            | contacts["email"].str.contains(query, case=False, regex=False, na=False)).astype(bool)
+
+
+def search_contacts(contacts: pd.DataFrame, query: str) -> pd.DataFrame:
+    """Rows whose name or email contains ``query`` (case-insensitive)."""
+    query = (query or "").strip()
+    if not query:
+        return contacts
+    return contacts[search_mask(contacts, query)]
+
+
+def compact_contacts(contacts: pd.DataFrame) -> pd.DataFrame:
+    """Arrow-backed strings, and categoricals for repetitive extra columns."""
+    compact = {}
+    for col in contacts.columns:
+        values = contacts[col]
+        if col not in REQUIRED_COLUMNS and values.nunique() <= len(values) // 2:
+            compact[col] = values.astype("category")
+        else:
+            compact[col] = values.astype(STRING_DTYPE)
+    return pd.DataFrame(compact, index=contacts.index)
+
+
+def read_header(source) -> List[str]:
+    """Normalized column names of a CSV, leaving ``source`` rewound."""
+    header = pd.read_csv(source, nrows=0).columns
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return [_normalize(col) for col in header]
+
+
+def ingest_csv(source, extra_columns: Iterable[str] = (),
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> IngestResult:
+    """Stream ``source`` and return the validated contacts plus counters.
+
+    ``source`` is a path or file-like object. Besides ``name`` and
+    ``email``, only ``extra_columns`` (e.g. the placeholders the template
+    uses) are parsed; everything else in the file is skipped by the parser.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    available = read_header(source)
+    missing = [col for col in REQUIRED_COLUMNS if col not in available]
+    extras = [col for col in dict.fromkeys(_normalize(c) for c in extra_columns)
+              if col in available and col not in REQUIRED_COLUMNS]
+    columns = REQUIRED_COLUMNS + extras
+    if missing:
+        empty = pd.DataFrame(columns=columns)
+        return IngestResult(empty, empty, missing_columns=missing,
+                            available_columns=available, columns=columns)
+
+    wanted = set(columns)
+    result = IngestResult(None, None, available_columns=available)
+    valid_chunks = []
+    invalid_chunks = []
+    invalid_kept = 0
+
+    reader = pd.read_csv(
+        source,
+        usecols=lambda col: _normalize(col) in wanted,
+        dtype=STRING_DTYPE,
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        chunk.columns = [_normalize(col) for col in chunk.columns]
+        # A header may repeat a column under different casing; keep the first
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()][columns]
+        result.total_rows += len(chunk)
+
+        # Remove rows with missing name or email
+        chunk["name"] = chunk["name"].str.strip()
+        present = (chunk["name"].fillna("") != "") & chunk["email"].notna()
+        result.missing_values += int((~present).sum())
+        chunk = chunk[present]
+
+        normalized = normalize_emails(chunk["email"])
+        chunk["email"] = normalized["email"]
+
+        # Validate email format (basic)
+        email_valid = valid_emails(chunk["email"])
+        invalid_count = int((~email_valid).sum())
+        result.invalid_emails += invalid_count
+        if invalid_count and invalid_kept < INVALID_SAMPLE_SIZE:
+            sample = chunk.loc[~email_valid, REQUIRED_COLUMNS].head(INVALID_SAMPLE_SIZE - invalid_kept)
+            invalid_chunks.append(sample)
+            invalid_kept += len(sample)
+
+        # Throwaway inboxes
+        disposable = normalized["domain"].isin(DISPOSABLE_DOMAINS) & email_valid
+        result.disposable += int(disposable.sum())
+
+        keep = email_valid & ~disposable
+        valid_chunks.append(chunk[keep].assign(_key=normalized.loc[keep, "key"]))
+
+    if valid_chunks:
+        contacts = pd.concat(valid_chunks, ignore_index=True)
+        # Hash-based dedupe across the whole upload; first occurrence wins
+        duplicated = contacts["_key"].duplicated()
+        result.duplicates = int(duplicated.sum())
+        contacts = contacts[~duplicated].drop(columns="_key").reset_index(drop=True)
+    else:
+        contacts = pd.DataFrame(columns=columns)
+    if extras:
+        contacts[extras] = contacts[extras].fillna("")
+    result.contacts = compact_contacts(contacts)
+    result.columns = list(result.contacts.columns)
+    result.valid_rows = len(result.contacts)
+    result.invalid_sample = (pd.concat(invalid_chunks, ignore_index=True) if invalid_chunks
+                             else pd.DataFrame(columns=REQUIRED_COLUMNS))
+    return result
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class IngestCache:
+    """LRU of ingest results keyed by file content hash, bounded by size.
+
+    Entries are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get_or_ingest(self, data: bytes, extra_columns: Iterable[str] = (),
+                      chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      need_contacts: bool = False) -> Tuple[IngestResult, bool]:
+        """Return ``(result, cache_hit)`` for the CSV bytes in ``data``.
+
+        A cached result whose contacts were released has ``contacts`` set
+        to None; pass ``need_contacts`` to parse the file again instead.
+        """
+        digest = file_hash(data)
+        key = (digest, tuple(sorted({_normalize(c) for c in extra_columns})))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not (need_contacts and entry[0].contacts is None):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], True
+            self.misses += 1
+
+        result = ingest_csv(io.BytesIO(data), extra_columns, chunk_size)
+        result.source_hash = digest
+        size = result.nbytes
+        with self._lock:
+            # Results bigger than the whole budget are returned but not kept
+            if size <= self.max_bytes:
+                self._drop(key)
+                self._entries[key] = (result, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+        return result, False
+
+    def release_contacts(self, source_hash: str) -> None:
+        """Drop the contacts of every cached result for a file, keeping its counters.
+
+        For once the list is held elsewhere (the app's DatasetStore), so it
+        is not kept twice.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == source_hash]:
+                result, _ = self._entries[key]
+                if result.contacts is None:
+                    continue
+                released = replace(result, contacts=None)
+                self._drop(key)
+                self._entries[key] = (released, released.nbytes)
+                self._bytes += released.nbytes
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
@@ -0,0 +1,182 @@
+"""Domain-level deliverability checks.
+
+Recipients are grouped by domain so each domain is resolved once, and
+verdicts are kept in a SQLite cache with a TTL so repeat uploads cost no
+lookups at all. The resolver is any callable mapping a domain to a
+``DomainVerdict``; ``dns_resolver`` is the real one and ``StubResolver``
+answers from a dict for offline use.
+"""
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:  # dnspython is optional; fall back to A/AAAA lookups
+    dns = None
+
+DEFAULT_CACHE_PATH = "domain_cache.sqlite3"
+ACCEPT_TTL = 7 * 24 * 3600
+REJECT_TTL = 24 * 3600
+DEFAULT_LOOKUP_TIMEOUT = 3.0
+DEFAULT_LOOKUP_CONCURRENCY = 32
+# Without dnspython no lookup can reject a domain, so screening is a no-op
+MX_LOOKUPS = dns is not None
+
+
+class DomainVerdict(NamedTuple):
+    accepts: bool
+    reason: str
+    # Transient answers (timeouts, resolver errors) are not cached
+    final: bool = True
+
+
+Resolver = Callable[[str], DomainVerdict]
+
+
+def dns_resolver(domain: str, timeout: float = DEFAULT_LOOKUP_TIMEOUT) -> DomainVerdict:
+    """Resolve MX records, falling back to A/AAAA (RFC 5321 implicit MX).
+
+    With dnspython a domain is rejected on NXDOMAIN, a null MX, or no MX and
+    no address records. Other lookup failures are treated as deliverable and
+    not cached, so a flaky resolver never drops real recipients. Without
+    dnspython MX is never checked, so the A/AAAA lookup can only confirm a
+    domain, not reject it.
+    """
+    if dns is not None:
+        try:
+            answer = dns.resolver.resolve(domain, "MX", lifetime=timeout)
+            hosts = [str(record.exchange).rstrip(".") for record in answer]
+            # A single "." exchange is a null MX: the domain accepts no mail
+            if hosts == [""]:
+                return DomainVerdict(False, "null MX")
+            return DomainVerdict(True, "MX")
+        except dns.resolver.NXDOMAIN:
+            return DomainVerdict(False, "no such domain")
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.DNSException as e:
+            return DomainVerdict(True, f"lookup failed: {type(e).__name__}", final=False)
+        # No MX: mail goes to the domain's own address, if it has one
+        for rdtype in ("A", "AAAA"):
+            try:
+                dns.resolver.resolve(domain, rdtype, lifetime=timeout)
+                return DomainVerdict(True, rdtype)
+            except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+                continue
+            except dns.exception.DNSException as e:
+                return DomainVerdict(True, f"lookup failed: {type(e).__name__}", final=False)
+        return DomainVerdict(False, "no mail host")
+
+    try:
+        socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+        return DomainVerdict(True, "A/AAAA")
+    except socket.gaierror as e:
+        # No address says nothing about MX (and some resolvers answer
+        # EAI_NONAME for everything), so this is inconclusive
+        return DomainVerdict(True, f"lookup failed: {e.strerror}", final=False)
+
+
+class StubResolver:
+    """Offline resolver answering from a ``{domain: accepts}`` mapping."""
+
+    def __init__(self, verdicts: Dict[str, bool], default: bool = True):
+        self.verdicts = verdicts
+        self.default = default
+        self.lookups = 0
+
+    def __call__(self, domain: str) -> DomainVerdict:
+        self.lookups += 1
+        accepts = self.verdicts.get(domain, self.default)
+        return DomainVerdict(accepts, "stub" if accepts else "stub reject")
+
+
+class DomainCache:
+    """Persistent domain verdicts with separate accept/reject TTLs."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 accept_ttl: float = ACCEPT_TTL, reject_ttl: float = REJECT_TTL):
+        self.accept_ttl = accept_ttl
+        self.reject_ttl = reject_ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS domains ("
+            "domain TEXT PRIMARY KEY, accepts INTEGER NOT NULL, "
+            "reason TEXT NOT NULL, checked_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get_many(self, domains: Iterable[str]) -> Dict[str, DomainVerdict]:
+        """Fresh cached verdicts for whichever of ``domains`` have one."""
+        domains = list(domains)
+        now = time.time()
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(domains), 500):
+                chunk = domains[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT domain, accepts, reason, checked_at FROM domains "
+                    f"WHERE domain IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for domain, accepts, reason, checked_at in rows:
+                    ttl = self.accept_ttl if accepts else self.reject_ttl
+                    if now - checked_at < ttl:
+                        found[domain] = DomainVerdict(bool(accepts), reason)
+        return found
+
+    def put_many(self, verdicts: Dict[str, DomainVerdict]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO domains (domain, accepts, reason, checked_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(domain, int(v.accepts), v.reason, now)
+                 for domain, v in verdicts.items() if v.final],
+            )
+
+
+def verify_domains(domains: Iterable[str], resolver: Resolver = dns_resolver,
+                   cache: Optional[DomainCache] = None,
+                   concurrency: int = DEFAULT_LOOKUP_CONCURRENCY) -> Tuple[Dict[str, DomainVerdict], int]:
+    """Verdict for every distinct domain, and how many needed a lookup."""
+    domains = set(domains)
+    verdicts = cache.get_many(domains) if cache is not None else {}
+    to_check = sorted(domains - verdicts.keys())
+    if to_check:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(to_check)))) as pool:
+            looked_up = dict(zip(to_check, pool.map(resolver, to_check)))
+        if cache is not None:
+            cache.put_many(looked_up)
+        verdicts.update(looked_up)
+    return verdicts, len(to_check)
+
+
+def screen_contacts(contacts: pd.DataFrame, resolver: Resolver = dns_resolver,
+                    cache: Optional[DomainCache] = None) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+    """Drop contacts whose domain cannot receive mail.
+
+    Returns the kept contacts, per-domain stats (contacts, verdict, reason;
+    rejected domains first) and the number of live lookups performed.
+    """
+    domains = contacts["email"].str.replace(r"^.*@", "", regex=True)
+    counts = domains.value_counts()
+    verdicts, lookups = verify_domains(counts.index, resolver, cache)
+
+    accepts = pd.Series({d: v.accepts for d, v in verdicts.items()}, dtype=bool)
+    stats = pd.DataFrame({
+        "domain": counts.index,
+        "contacts": counts.to_numpy(),
+        "accepted": accepts.reindex(counts.index).to_numpy(),
+        "reason": [verdicts[d].reason for d in counts.index],
+    }).sort_values(["accepted", "contacts"], ascending=[True, False], ignore_index=True)
+
+    keep = domains.map(accepts).fillna(True).astype(bool)
+    return contacts[keep].reset_index(drop=True), stats, lookups
@@ -0,0 +1,187 @@
+"""Spreading sends over several webhook endpoints.
+
+An ``EndpointPool`` routes each request to the healthy endpoint with the
+fewest requests in flight relative to its weight. Endpoints are ejected
+after ``eject_after`` consecutive failures (connection errors, timeouts or
+5xx; a 429 is push-back, not ill health) and re-admitted when the ejection
+expires, with the ejection doubling each time up to ``max_ejection``.
+Endpoints with a ``health_url`` are also probed from a background thread,
+which stops when the pool is closed.
+If every endpoint is ejected, the one due back soonest is used anyway
+rather than failing the whole campaign.
+
+Pool configuration is a list of ``{"url", "weight", "health_url"}`` dicts,
+written in the app as one ``URL [WEIGHT] [HEALTH_URL]`` line per endpoint
+and in the CLI as repeated ``--endpoint URL [WEIGHT [HEALTH_URL]]``.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import requests
+
+EJECT_AFTER = 5
+BASE_EJECTION = 30.0
+MAX_EJECTION = 300.0
+PROBE_INTERVAL = 10.0
+PROBE_TIMEOUT = 5.0
+
+# One pool per configuration per process, so health survives across jobs;
+# the least recently used configurations beyond this are closed
+MAX_SHARED_POOLS = 8
+_shared: "OrderedDict[Tuple, EndpointPool]" = OrderedDict()
+_shared_lock = threading.Lock()
+
+
+def parse_endpoints(text: str) -> List[dict]:
+    """Parse ``URL [WEIGHT] [HEALTH_URL]`` lines; blank lines and ``#`` comments are skipped."""
+    endpoints = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts or parts[0].startswith("#"):
+            continue
+        weight = float(parts[1]) if len(parts) > 1 else 1.0
+        if weight <= 0:
+            raise ValueError(f"Endpoint weight must be positive: {line.strip()}")
+        endpoints.append({"url": parts[0], "weight": weight,
+                          "health_url": parts[2] if len(parts) > 2 else ""})
+    return endpoints
+
+
+@dataclass
+class Endpoint:
+    url: str
+    weight: float = 1.0
+    health_url: str = ""
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    # Consecutive failures since the last success
+    streak: int = 0
+    ejections: int = 0
+    ejected_until: float = 0.0
+    latency: Optional[float] = None
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+
+class EndpointPool:
+    def __init__(self, endpoints: Sequence[dict], eject_after: int = EJECT_AFTER,
+                 base_ejection: float = BASE_EJECTION, max_ejection: float = MAX_EJECTION,
+                 probe_interval: float = PROBE_INTERVAL):
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = [Endpoint(e["url"], float(e.get("weight", 1.0)), e.get("health_url", ""))
+                          for e in endpoints]
+        self.eject_after = eject_after
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if any(e.health_url for e in self.endpoints):
+            threading.Thread(target=self._probe_loop, name="endpoint-probe", daemon=True).start()
+
+    @staticmethod
+    def _key(endpoints: Sequence[dict]) -> Tuple:
+        return tuple((e["url"], float(e.get("weight", 1.0)), e.get("health_url", ""))
+                     for e in endpoints)
+
+    @classmethod
+    def shared(cls, endpoints: Sequence[dict]) -> "EndpointPool":
+        """The process-wide pool for this configuration, created on first use."""
+        key = cls._key(endpoints)
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cls(endpoints)
+                while len(_shared) > MAX_SHARED_POOLS:
+                    # A job still holding it keeps routing; only probing stops
+                    _shared.popitem(last=False)[1].close()
+            _shared.move_to_end(key)
+            return _shared[key]
+
+    @classmethod
+    def lookup(cls, endpoints: Sequence[dict]) -> Optional["EndpointPool"]:
+        """The shared pool for this configuration if one exists, without creating it."""
+        with _shared_lock:
+            return _shared.get(cls._key(endpoints))
+
+    def close(self) -> None:
+        """Stop health probes."""
+        self._closed.set()
+
+    @property
+    def urls(self) -> List[str]:
+        return [e.url for e in self.endpoints]
+
+    def acquire(self) -> Endpoint:
+        """Pick an endpoint for one request; pair every call with :meth:`release`."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if now >= e.ejected_until]
+            if not candidates:
+                candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+            best = min((e.outstanding + 1) / e.weight for e in candidates)
+            endpoint = random.choice([e for e in candidates
+                                      if (e.outstanding + 1) / e.weight == best])
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, status_code: Optional[int], elapsed: float) -> None:
+        """Record the outcome of a request sent to ``endpoint``."""
+        failed = status_code is None or status_code >= 500
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.latency = elapsed if endpoint.latency is None else \
+                0.8 * endpoint.latency + 0.2 * elapsed
+            if not failed:
+                endpoint.streak = 0
+                return
+            endpoint.failures += 1
+            endpoint.streak += 1
+            if endpoint.streak >= self.eject_after and endpoint.healthy:
+                self._eject(endpoint)
+
+    def _eject(self, endpoint: Endpoint) -> None:
+        duration = min(self.max_ejection, self.base_ejection * 2 ** endpoint.ejections)
+        endpoint.ejections += 1
+        endpoint.ejected_until = time.monotonic() + duration
+        # One failure after re-admission ejects it again
+        endpoint.streak = self.eject_after - 1
+
+    def _probe_loop(self) -> None:
+        session = requests.Session()
+        while not self._closed.wait(self.probe_interval):
+            for endpoint in self.endpoints:
+                if not endpoint.health_url:
+                    continue
+                try:
+                    ok = session.get(endpoint.health_url, timeout=PROBE_TIMEOUT).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                with self._lock:
+                    if ok and not endpoint.healthy:
+                        endpoint.ejected_until = 0.0
+                    elif not ok and endpoint.healthy:
+                        self._eject(endpoint)
+
+    def snapshot(self) -> List[dict]:
+        """Routing and health state of every endpoint, for display."""
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                "url": e.url,
+                "weight": e.weight,
+                "healthy": now >= e.ejected_until,
+                "ejected_for": max(0.0, e.ejected_until - now),
+                "in_flight": e.outstanding,
+                "requests": e.requests,
+                "failures": e.failures,
+                "latency_ms": round(e.latency * 1000, 1) if e.latency is not None else None,
+            } for e in self.endpoints]
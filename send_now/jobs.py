@@ -0,0 +1,501 @@
+"""Durable send jobs.
+
+Every campaign is recorded in a SQLite journal before the first email goes
+out: the job's settings and template, plus one row per recipient with its
+delivery state. Results are checkpointed as they arrive, so a job cut short
+by a closed tab or a restarted worker can be resumed and only recipients
+that were not yet delivered are sent again.
+
+A job can also be pre-rendered: every recipient's payload is rendered and
+JSON-encoded once ahead of the send and stored zlib-compressed, with the
+blank payload as preset dictionary so each row keeps only what differs.
+The send loop then only inflates bytes and posts them.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from send_now.endpoints import EndpointPool
+from send_now.ledger import SendLedger, idempotency_key
+from send_now.metrics import SendMetrics
+from send_now.sender import (
+    DEFAULT_BATCH_MAX_BYTES,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_TIMEOUT,
+    RateLimiter,
+    RetryPolicy,
+    SendResult,
+    dispatch,
+    dispatch_batches,
+    drain,
+    register_template,
+)
+from send_now.sheets import StatusWriter
+from send_now.templating import CompiledTemplate, compile_template, reference_payload
+
+DEFAULT_JOURNAL_PATH = "send_jobs.sqlite3"
+CHECKPOINT_EVERY = 200
+CHECKPOINT_SECONDS = 1.0
+_PAGE_SIZE = 1_000
+
+# Recipient states
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+# Already delivered by another job, per the send ledger
+SKIPPED = "skipped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    state TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    spec TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    job_id TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    fields TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    status_code INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (job_id, pos)
+);
+CREATE INDEX IF NOT EXISTS recipients_state ON recipients (job_id, state);
+CREATE TABLE IF NOT EXISTS bodies (
+    job_id TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (job_id, pos)
+) WITHOUT ROWID;
+"""
+
+
+class JobError(Exception):
+    pass
+
+
+@dataclass
+class JobSpec:
+    url: str
+    subject: str
+    template: str
+    by_reference: bool = False
+    # 0 sends one request per recipient
+    batch_size: int = 0
+    batch_max_bytes: int = DEFAULT_BATCH_MAX_BYTES
+    concurrency: int = DEFAULT_CONCURRENCY
+    timeout: float = DEFAULT_TIMEOUT
+    # Requests per second ceiling; 0 leaves only the 429/Retry-After brakes
+    rate_limit: float = 0
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    # Apps Script web app that receives per-recipient delivery status
+    status_sheet_url: str = ""
+    # Optional pool ({"url", "weight", "health_url"} dicts) used instead of url
+    endpoints: List[dict] = field(default_factory=list)
+    # Render all payloads ahead of the send (one request per recipient only)
+    prerender: bool = False
+    # Ledger scope: a recipient gets each template once per campaign
+    # (empty means the subject line)
+    campaign: str = ""
+    # Skip recipients the send ledger says already got this email
+    dedupe: bool = True
+
+    @property
+    def campaign_name(self) -> str:
+        return self.campaign or self.subject
+
+    @property
+    def uses_prerender(self) -> bool:
+        # Reference payloads carry no body, and batches are built per request
+        return self.prerender and not self.batch_size and not self.by_reference
+
+    @property
+    def hosts(self) -> int:
+        """Hosts a run talks to: the webhook or every pool endpoint, plus the status sheet."""
+        urls = [e["url"] for e in self.endpoints] or [self.url]
+        return len({urlsplit(url).netloc for url in urls}) + 1
+
+    def target(self):
+        """Where to send: ``url``, or the shared pool of ``endpoints``."""
+        return EndpointPool.shared(self.endpoints) if self.endpoints else self.url
+
+
+def build_payload(compiled: CompiledTemplate, subject: str, name: str, email: str,
+                  values: dict, by_reference: bool = False,
+                  idempotency_key: Optional[str] = None) -> dict:
+    """Webhook payload for one recipient."""
+    if by_reference:
+        payload = reference_payload(compiled.template_id, subject, email,
+                                    {"name": name, **compiled.merge_vars(values)})
+    else:
+        payload = {
+            "subject": subject,
+            "email": email,
+            "name": name,
+            "html_content": compiled.render(values),
+        }
+    if idempotency_key is not None:
+        payload["idempotency_key"] = idempotency_key
+    return payload
+
+
+def payload_dictionary(compiled: CompiledTemplate, subject: str) -> bytes:
+    """zlib preset dictionary for a job's payloads: the payload with every field blank."""
+    blank = json.dumps(build_payload(compiled, subject, "", "", {}, idempotency_key=""),
+                       allow_nan=False)
+    # zlib only looks back 32 KB
+    return blank.encode("utf-8")[-32768:]
+
+
+def inflate_payload(blob: bytes, dictionary: bytes) -> bytes:
+    return zlib.decompressobj(zdict=dictionary).decompress(blob)
+
+
+class JobJournal:
+    """SQLite-backed record of send jobs and per-recipient delivery state."""
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def create_job(self, spec: JobSpec, contacts: pd.DataFrame) -> str:
+        """Journal ``contacts`` (name, email and template columns) as a new job."""
+        job_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        compiled = compile_template(spec.template)
+        merge_cols = [col for col in compiled.fields if col in contacts.columns]
+
+        def rows():
+            columns = zip(contacts["name"], contacts["email"],
+                          *(contacts[col] for col in merge_cols))
+            for pos, (name, email, *merge_values) in enumerate(columns):
+                fields = json.dumps(dict(zip(merge_cols, merge_values))) if merge_cols else None
+                yield job_id, pos, name, email, fields
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, created_at, state, total, spec) VALUES (?, ?, ?, ?, ?)",
+                (job_id, datetime.now().isoformat(timespec="seconds"), PENDING,
+                 len(contacts), json.dumps(asdict(spec))),
+            )
+            self._conn.executemany(
+                "INSERT INTO recipients (job_id, pos, name, email, fields) VALUES (?, ?, ?, ?, ?)",
+                rows(),
+            )
+        return job_id
+
+    def spec(self, job_id: str) -> JobSpec:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT spec FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobError(f"Unknown job {job_id}")
+        return JobSpec(**json.loads(row[0]))
+
+    def set_state(self, job_id: str, state: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ? WHERE job_id = ?", (state, job_id))
+
+    def _undelivered_pages(self, job_id: str, with_bodies: bool, missing_only: bool = False):
+        query = ("SELECT r.pos, r.name, r.email, r.fields, b.payload FROM recipients r "
+                 "LEFT JOIN bodies b ON b.job_id = r.job_id AND b.pos = r.pos "
+                 if with_bodies else
+                 "SELECT r.pos, r.name, r.email, r.fields, NULL FROM recipients r ")
+        query += "WHERE r.job_id = ? AND r.state NOT IN (?, ?) AND r.pos > ? "
+        if missing_only:
+            query += "AND b.payload IS NULL "
+        query += "ORDER BY r.pos LIMIT ?"
+        last_pos = -1
+        while True:
+            with self._lock:
+                page = self._conn.execute(
+                    query, (job_id, SENT, SKIPPED, last_pos, _PAGE_SIZE)).fetchall()
+            if not page:
+                return
+            yield page
+            last_pos = page[-1][0]
+
+    def undelivered(self, job_id: str, with_bodies: bool = False) -> Iterator[tuple]:
+        """``(pos, name, email, fields)`` for every recipient not yet sent or skipped.
+
+        With ``with_bodies``, a fifth item holds the pre-rendered payload
+        (compressed, see :meth:`prerender`) or ``None``. Read in pages so
+        checkpoints can be written between them.
+        """
+        for page in self._undelivered_pages(job_id, with_bodies):
+            for pos, name, email, fields, body in page:
+                row = (pos, name, email, json.loads(fields) if fields else {})
+                yield row + (body,) if with_bodies else row
+
+    def prerender(self, job_id: str, on_progress=None) -> int:
+        """Render and store the payload of every undelivered recipient that has none yet.
+
+        ``on_progress(rendered)`` is called after each page. Returns the
+        number of payloads rendered.
+        """
+        spec = self.spec(job_id)
+        compiled = compile_template(spec.template)
+        dictionary = payload_dictionary(compiled, spec.subject)
+        rendered = 0
+        for page in self._undelivered_pages(job_id, with_bodies=True, missing_only=True):
+            rows = []
+            for pos, name, email, fields, _ in page:
+                payload = build_payload(
+                    compiled, spec.subject, name, email, json.loads(fields) if fields else {},
+                    idempotency_key=idempotency_key(
+                        spec.campaign_name, compiled.template_id, email).hex())
+                deflate = zlib.compressobj(zdict=dictionary)
+                body = json.dumps(payload, allow_nan=False).encode("utf-8")
+                rows.append((job_id, pos, deflate.compress(body) + deflate.flush()))
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO bodies (job_id, pos, payload) VALUES (?, ?, ?)", rows)
+            rendered += len(rows)
+            if on_progress is not None:
+                on_progress(rendered)
+        return rendered
+
+    def discard_bodies(self, job_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM bodies WHERE job_id = ?", (job_id,))
+
+    def recipients(self, job_id: str, positions: Sequence[int]) -> dict:
+        """``{pos: (name, email)}`` for the given recipient positions."""
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(positions), 900):
+                chunk = list(positions[start:start + 900])
+                rows = self._conn.execute(
+                    "SELECT pos, name, email FROM recipients WHERE job_id = ? "
+                    f"AND pos IN ({','.join('?' * len(chunk))})",
+                    [job_id, *chunk],
+                ).fetchall()
+                found.update((pos, (name, email)) for pos, name, email in rows)
+        return found
+
+    def record(self, job_id: str, results: Sequence[SendResult]) -> None:
+        """Checkpoint a batch of results in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE recipients SET state = ?, status_code = ?, error = ?, "
+                "attempts = attempts + ?, updated_at = ? WHERE job_id = ? AND pos = ?",
+                [(SKIPPED if r.skipped else SENT if r.ok else FAILED,
+                  r.status_code, r.error, r.attempts, now, job_id, r.key)
+                 for r in results],
+            )
+
+    def counts(self, job_id: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM recipients WHERE job_id = ? GROUP BY state",
+                (job_id,),
+            ).fetchall()
+        counts = {PENDING: 0, SENT: 0, FAILED: 0, SKIPPED: 0}
+        counts.update(rows)
+        return counts
+
+    def jobs(self, limit: int = 20) -> List[dict]:
+        """Most recent jobs with their delivery counts."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT j.job_id, j.created_at, j.state, j.total, "
+                "SUM(r.state = 'sent'), SUM(r.state = 'failed'), SUM(r.state = 'skipped') "
+                "FROM jobs j JOIN recipients r ON r.job_id = j.job_id "
+                "GROUP BY j.job_id ORDER BY j.created_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"job_id": job_id, "created_at": created_at, "state": state, "total": total,
+             "sent": sent or 0, "failed": failed or 0, "skipped": skipped or 0,
+             "remaining": total - (sent or 0) - (skipped or 0)}
+            for job_id, created_at, state, total, sent, failed, skipped in rows
+        ]
+
+    def results_frame(self, job_id: str, limit: Optional[int] = None) -> pd.DataFrame:
+        """Per-recipient results in the shape of the app's results table."""
+        query = ("SELECT name, email, state, status_code, error FROM recipients "
+                 "WHERE job_id = ? ORDER BY pos")
+        params = [job_id]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return pd.DataFrame(
+            [{"name": name, "email": email,
+              "status": "⏳ Pending" if state == PENDING
+              else SendResult(None, state == SENT, status_code, error,
+                              skipped=state == SKIPPED).status}
+             for name, email, state, status_code, error in rows],
+            columns=["name", "email", "status"],
+        )
+
+
+def run_job(journal: JobJournal, job_id: str, session=None,
+            checkpoint_every: int = CHECKPOINT_EVERY,
+            checkpoint_seconds: float = CHECKPOINT_SECONDS,
+            metrics: Optional[SendMetrics] = None,
+            ledger: Optional[SendLedger] = None) -> Iterator[SendResult]:
+    """Send every undelivered recipient of ``job_id``, yielding results.
+
+    Results are written to the journal at least every ``checkpoint_every``
+    results or ``checkpoint_seconds``, and on exit. Recipients in flight
+    when the process dies stay pending and are sent again on resume. With
+    ``spec.status_sheet_url`` set, results are also written back to the
+    sheet in bulk. Every webhook request is recorded in ``metrics``.
+
+    With a ``ledger``, recipients are claimed a page at a time before they
+    are sent; those another job already sent come back as skipped results,
+    unless ``spec.dedupe`` is off, and those another unfinished job has
+    claimed stay pending for a resume. Outcomes are settled in the ledger
+    at each checkpoint, and claims left unsent are released on exit.
+    """
+    spec = journal.spec(job_id)
+    compiled = compile_template(spec.template)
+    target = spec.target()
+
+    if spec.by_reference:
+        registration = register_template(target, compiled.template_id, compiled.source,
+                                         timeout=spec.timeout, session=session)
+        if registration is not None and not registration.ok:
+            raise JobError(f"Could not register template: {registration.status}")
+
+    # One limiter per run, shared by every dispatch thread
+    limiter = RateLimiter(spec.rate_limit)
+    retry = RetryPolicy(max_attempts=spec.max_attempts)
+
+    status_writer = None
+    if spec.status_sheet_url:
+        status_writer = StatusWriter(spec.status_sheet_url, timeout=spec.timeout,
+                                     session=session)
+    # Name, email and ledger key of recipients in flight
+    in_flight = {}
+    # Recipients the ledger turned away, reported alongside the sends
+    skipped = deque()
+
+    dictionary = payload_dictionary(compiled, spec.subject) if spec.uses_prerender else None
+
+    def payloads():
+        rows = journal.undelivered(job_id, with_bodies=spec.uses_prerender)
+        while True:
+            page = list(islice(rows, _PAGE_SIZE))
+            if not page:
+                return
+            keys = [idempotency_key(spec.campaign_name, compiled.template_id, row[2])
+                    for row in page]
+            granted = delivered = None
+            if ledger is not None and spec.dedupe:
+                granted = ledger.claim(job_id, keys)
+                delivered = ledger.delivered([key for key in keys if key not in granted])
+            for (pos, name, email, fields, *body), key in zip(page, keys):
+                if granted is not None and key not in granted:
+                    # Claimed by another unfinished job: left pending, so a
+                    # resume claims it again once that job settles or lets go
+                    if key in delivered:
+                        skipped.append((pos, name, email))
+                    continue
+                in_flight[pos] = (name, email, key)
+                body = body[0] if body else None
+                if body is not None:
+                    yield pos, inflate_payload(body, dictionary)
+                else:
+                    yield pos, build_payload(compiled, spec.subject, name, email, fields,
+                                             spec.by_reference, idempotency_key=key.hex())
+
+    if spec.batch_size:
+        results = dispatch_batches(payloads(), target, batch_size=spec.batch_size,
+                                   max_bytes=spec.batch_max_bytes,
+                                   concurrency=spec.concurrency,
+                                   timeout=spec.timeout, session=session,
+                                   limiter=limiter, retry=retry, metrics=metrics)
+    else:
+        results = dispatch(payloads(), target, concurrency=spec.concurrency,
+                           timeout=spec.timeout, session=session,
+                           limiter=limiter, retry=retry, metrics=metrics)
+
+    def drain_skipped():
+        while skipped:
+            pos, name, email = skipped.popleft()
+            yield SendResult(pos, False, attempts=0, skipped=True), (name, email, None)
+
+    def with_skipped(results):
+        for result in results:
+            yield from drain_skipped()
+            yield result, in_flight.pop(result.key)
+        yield from drain_skipped()
+
+    buffered, settled = [], []
+
+    def collect(result, name, email, key):
+        if not result.skipped:
+            settled.append((result.ok, key))
+        buffered.append(result)
+        if status_writer is not None:
+            status_writer.add(job_id, name, email, result)
+
+    def checkpoint():
+        # Ledger first: a crash in between must leave delivered keys marked
+        # sent for every job, not just pending in this one's journal
+        if ledger is not None and settled:
+            ledger.settle(job_id, [key for ok, key in settled if ok],
+                          [key for ok, key in settled if not ok])
+        journal.record(job_id, buffered)
+        buffered.clear()
+        settled.clear()
+
+    journal.set_state(job_id, "running")
+    last_checkpoint = time.monotonic()
+    try:
+        for result, (name, email, key) in with_skipped(results):
+            collect(result, name, email, key)
+            if (len(buffered) >= checkpoint_every
+                    or time.monotonic() - last_checkpoint >= checkpoint_seconds):
+                checkpoint()
+                last_checkpoint = time.monotonic()
+            yield result
+    finally:
+        # Stopped early (pause, Ctrl-C): queued requests are cancelled, but
+        # those already under way still reach the webhook, so wait for them
+        # and record and settle them rather than leave them pending (and
+        # claimed by this job, so granted again) for a resend
+        for result, (name, email, key) in with_skipped(drain(results)):
+            collect(result, name, email, key)
+        if buffered:
+            checkpoint()
+        if ledger is not None:
+            # Everything sent is settled by now; what this job still holds
+            # was claimed but never sent, so let other jobs have it
+            ledger.release(job_id)
+        if status_writer is not None:
+            status_writer.close()
+        counts = journal.counts(job_id)
+        journal.set_state(job_id, "done" if counts[PENDING] == 0 else "interrupted")
+        # Failed recipients may still be resumed, so keep their bodies until then
+        if spec.uses_prerender and counts[PENDING] == 0 and counts[FAILED] == 0:
+            journal.discard_bodies(job_id)
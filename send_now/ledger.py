@@ -0,0 +1,130 @@
+"""Cross-campaign send ledger.
+
+Every (recipient, template, campaign) triple gets an idempotency key: the
+first 16 bytes of a SHA-256 over the three. The key travels in each
+webhook payload (as ``idempotency_key``), so the webhook can drop a
+repeat. The ledger, a SQLite table keyed by it, records who has been
+sent what, across jobs, operators and restarts.
+
+Jobs claim their recipients in bulk, a page at a time, before those
+recipients are dispatched. A key that is already sent, or claimed by
+another job within ``claim_ttl``, is not granted: the job skips a sent
+recipient and leaves a claimed one pending until it can claim it.
+Delivered keys are marked sent. Failed ones are released, as is whatever
+a job claimed but had not sent when it stopped, so a resume or a later
+job can try again, still under the same idempotency key.
+
+The table is ``WITHOUT ROWID`` with a 16-byte blob primary key, so lookups
+stay a single B-tree probe and rows stay small at tens of millions of
+entries.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Sequence, Set
+
+DEFAULT_LEDGER_PATH = "send_ledger.sqlite3"
+# An unfinished job's claims block other jobs for this long
+CLAIM_TTL = 6 * 3600
+# Stay under SQLite's bound-parameter limit
+_CHUNK = 900
+
+# Ledger states
+CLAIMED = 0
+DELIVERED = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    key BLOB PRIMARY KEY,
+    state INTEGER NOT NULL,
+    job_id TEXT NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def idempotency_key(campaign: str, template_id: str, email: str) -> bytes:
+    """16-byte key for one recipient of one template in one campaign."""
+    digest = hashlib.sha256(
+        f"{campaign}\x1f{template_id}\x1f{email.strip().lower()}".encode("utf-8"))
+    return digest.digest()[:16]
+
+
+def _chunks(keys: Sequence[bytes]) -> Iterable[List[bytes]]:
+    for start in range(0, len(keys), _CHUNK):
+        yield list(keys[start:start + _CHUNK])
+
+
+class SendLedger:
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH, claim_ttl: float = CLAIM_TTL):
+        self.path = path
+        self.claim_ttl = claim_ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def delivered(self, keys: Sequence[bytes]) -> Set[bytes]:
+        """The subset of ``keys`` already delivered."""
+        found = set()
+        with self._lock:
+            for chunk in _chunks(keys):
+                found.update(row[0] for row in self._conn.execute(
+                    f"SELECT key FROM ledger WHERE state = {DELIVERED} "
+                    f"AND key IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def claim(self, job_id: str, keys: Sequence[bytes]) -> Set[bytes]:
+        """Reserve ``keys`` for ``job_id``; returns the keys it may send.
+
+        Granted are new keys, keys this job already holds (a resume), and
+        stale claims of other jobs, which are taken over. ``run_job``
+        settles every finished request before it stops, so a key still
+        held on resume was never sent, or was in flight when the process
+        died; the payload's idempotency key covers the latter.
+        """
+        now = time.time()
+        stale = now - self.claim_ttl
+        granted = set()
+        with self._lock, self._conn:
+            for chunk in _chunks(keys):
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO ledger (key, state, job_id, updated_at) "
+                    f"VALUES (?, {CLAIMED}, ?, ?)",
+                    [(key, job_id, now) for key in chunk])
+                placeholders = ",".join("?" * len(chunk))
+                self._conn.execute(
+                    f"UPDATE ledger SET job_id = ?, updated_at = ? WHERE state = {CLAIMED} "
+                    f"AND job_id != ? AND updated_at < ? AND key IN ({placeholders})",
+                    [job_id, now, job_id, stale, *chunk])
+                granted.update(row[0] for row in self._conn.execute(
+                    f"SELECT key FROM ledger WHERE state = {CLAIMED} AND job_id = ? "
+                    f"AND key IN ({placeholders})", [job_id, *chunk]))
+        return granted
+
+    def settle(self, job_id: str, delivered: Sequence[bytes], failed: Sequence[bytes]) -> None:
+        """Mark delivered keys sent and release this job's claims on failed ones."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO ledger (key, state, job_id, updated_at) "
+                f"VALUES (?, {DELIVERED}, ?, ?)",
+                [(key, job_id, now) for key in delivered])
+            self._conn.executemany(
+                f"DELETE FROM ledger WHERE key = ? AND job_id = ? AND state = {CLAIMED}",
+                [(key, job_id) for key in failed])
+
+    def release(self, job_id: str) -> None:
+        """Drop every claim ``job_id`` still holds (e.g. when it stops)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM ledger WHERE job_id = ? AND state = {CLAIMED}", (job_id,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
@@ -0,0 +1,163 @@
+"""Send-path telemetry.
+
+``SendMetrics`` records one observation per HTTP attempt: latency, status
+code (or ``"error"`` when no response came back) and request body bytes.
+It keeps Prometheus-style cumulative histogram buckets, a reservoir of
+recent latencies for p50/p95/p99, and a one-minute ring of per-second
+counts for the rolling request rate. ``serve_metrics`` exposes it over
+HTTP as Prometheus text (``/metrics``) and JSON (``/metrics.json``).
+"""
+import json
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RESERVOIR_SIZE = 10_000
+RATE_WINDOW = 60
+
+
+def _percentile(sorted_values, q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class SendMetrics:
+    def __init__(self, name: str = "send_now_webhook"):
+        self.name = name
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._bytes_sent = 0
+        self._latency_sum = 0.0
+        self._buckets = [0] * len(LATENCY_BUCKETS)
+        self._statuses = Counter()
+        self._recent = deque(maxlen=RESERVOIR_SIZE)
+        # (second, count) pairs for the last RATE_WINDOW seconds
+        self._per_second = deque()
+
+    def observe(self, status_code: Optional[int], elapsed: float, bytes_sent: int = 0) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._requests += 1
+            self._bytes_sent += bytes_sent
+            self._latency_sum += elapsed
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    self._buckets[i] += 1
+                    break
+            self._statuses[str(status_code) if status_code is not None else "error"] += 1
+            self._recent.append(elapsed)
+            if self._per_second and self._per_second[-1][0] == now:
+                self._per_second[-1][1] += 1
+            else:
+                self._per_second.append([now, 1])
+            while self._per_second and self._per_second[0][0] <= now - RATE_WINDOW:
+                self._per_second.popleft()
+
+    def rate(self, window: int = 10) -> float:
+        """Requests per second over the last ``window`` complete seconds."""
+        window = max(1, min(window, RATE_WINDOW))
+        now = int(time.time())
+        with self._lock:
+            count = sum(c for second, c in self._per_second if now - window <= second < now)
+        return count / window
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+            snapshot = {
+                "requests": self._requests,
+                "bytes_sent": self._bytes_sent,
+                "latency_sum": self._latency_sum,
+                "status_codes": dict(self._statuses),
+                "buckets": list(zip(LATENCY_BUCKETS, self._buckets)),
+            }
+        snapshot.update({
+            "p50": _percentile(recent, 0.50),
+            "p95": _percentile(recent, 0.95),
+            "p99": _percentile(recent, 0.99),
+            "rate_10s": self.rate(10),
+            "rate_60s": self.rate(60),
+            "uptime": time.time() - self.started,
+        })
+        return snapshot
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+        snapshot["buckets"] = {str(bound): count for bound, count in snapshot["buckets"]}
+        return json.dumps(snapshot, indent=2)
+
+    def to_prometheus(self) -> str:
+        s = self.snapshot()
+        n = self.name
+        lines = [
+            f"# HELP {n}_requests_total HTTP attempts made to the webhook.",
+            f"# TYPE {n}_requests_total counter",
+        ]
+        for code, count in sorted(s["status_codes"].items()):
+            lines.append(f'{n}_requests_total{{code="{code}"}} {count}')
+        lines += [
+            f"# HELP {n}_request_bytes_total Request body bytes sent.",
+            f"# TYPE {n}_request_bytes_total counter",
+            f"{n}_request_bytes_total {s['bytes_sent']}",
+            f"# HELP {n}_request_duration_seconds Latency of each attempt.",
+            f"# TYPE {n}_request_duration_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in s["buckets"]:
+            cumulative += count
+            lines.append(f'{n}_request_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f'{n}_request_duration_seconds_bucket{{le="+Inf"}} {s["requests"]}',
+            f"{n}_request_duration_seconds_sum {s['latency_sum']:.6f}",
+            f"{n}_request_duration_seconds_count {s['requests']}",
+            f"# HELP {n}_requests_per_second Rolling request rate over 10s.",
+            f"# TYPE {n}_requests_per_second gauge",
+            f"{n}_requests_per_second {s['rate_10s']:.3f}",
+        ]
+        quantiles = [(label, s[key]) for label, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+                     if s[key] is not None]
+        if quantiles:
+            lines += [
+                f"# HELP {n}_request_duration_quantile_seconds Latency quantiles of recent attempts.",
+                f"# TYPE {n}_request_duration_quantile_seconds gauge",
+            ]
+            lines += [f'{n}_request_duration_quantile_seconds{{quantile="{label}"}} {value:.6f}'
+                      for label, value in quantiles]
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics: SendMetrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` and ``/metrics.json`` from a daemon thread.
+
+    Only local clients can connect unless ``host`` says otherwise.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, content_type = metrics.to_json(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,462 @@
+"""One-off size optimization of an email template.
+
+``optimize_template`` rewrites a template once per version (results are
+cached by content hash) before it is compiled and sent:
+
+* CSS from ``<style>`` blocks is inlined into the elements it matches, as
+  most mail clients expect. Only simple selectors are inlined: type,
+  ``.class``, ``#id``, compounds of those, and descendant chains. Pseudo-
+  classes, ``@media`` and other rules that cannot live in a ``style``
+  attribute stay in the ``<style>`` block. Their declarations, including
+  those of rules inside ``@media``/``@supports``, are marked ``!important``
+  where they set a property just inlined on an element they apply to,
+  since the inline value would otherwise win.
+* Rules that match no element are dropped, and so are ``class`` names
+  that no remaining rule refers to.
+* Comments are removed, except conditional comments (``<!--[if ...]>``,
+  including the ``<!--[if !mso]><!-->`` ... ``<!--<![endif]-->`` form). Whitespace is
+  collapsed, and dropped next to block-level tags, outside
+  ``<pre>``/``<textarea>``.
+* Asset URLs (``src``, ``background``, CSS ``url()``) that differ only in
+  case of scheme/host or surrounding whitespace are rewritten to one
+  spelling so clients fetch them once; repeats are listed in the report.
+
+``{placeholder}`` fields pass through untouched.
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+_CACHE_SIZE = 32
+
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+# Never starts inside conditional-comment syntax: <!--[if ...]>, the
+# "downlevel-revealed" <!--> opener and the <!--<![endif]--> closer
+_HTML_COMMENT_RE = re.compile(r"<!--(?!-?>)(?!\[if)(?!<!).*?-->", re.S)
+# type, .class and #id compounds, optionally chained by whitespace
+_COMPOUND_RE = re.compile(r"^(\*|[a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)$")
+_CONDITIONAL_RE = re.compile(r"\[if\b|\[endif\]", re.I)
+_PSEUDO_RE = re.compile(r"::?[\w-]+(?:\([^)]*\))?")
+_PROTECTED_RE = re.compile(r"(<(pre|textarea|script)\b.*?</\2\s*>)", re.S | re.I)
+_BLOCK_TAG_RE = re.compile(
+    r"\s*(</?(?:html|head|body|div|p|h[1-6]|table|thead|tbody|tfoot|tr|td|th|ul|ol|li|"
+    r"meta|title|style|link|br|hr|center|section|header|footer)\b[^>]*>)\s*", re.I)
+_IMPORTANT_RE = re.compile(r"!\s*important\s*$", re.I)
+_CONDITIONAL_GROUP_RE = re.compile(r"@(?:media|supports)\b[^{]*\{", re.I)
+_CSS_URL_RE = re.compile(r"url\(\s*(['\"]?)(.*?)\1\s*\)", re.I)
+_VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input",
+                        "link", "meta", "source", "track", "wbr"})
+
+
+@dataclass
+class OptimizeReport:
+    original_bytes: int = 0
+    optimized_bytes: int = 0
+    inlined_rules: int = 0
+    removed_rules: int = 0
+    kept_rules: int = 0
+    # Asset URL -> references in the template, for assets used more than once
+    repeated_assets: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.optimized_bytes
+
+    @property
+    def saved_ratio(self) -> float:
+        return self.saved_bytes / self.original_bytes if self.original_bytes else 0.0
+
+
+@dataclass
+class OptimizedTemplate:
+    source: str
+    html: str
+    report: OptimizeReport
+
+
+# ---------------------------------------------------------------- CSS
+
+
+@dataclass
+class _Rule:
+    selectors: List[str]
+    declarations: List[Tuple[str, str]]
+    order: int
+
+
+def _split_declarations(text: str) -> List[Tuple[str, str]]:
+    """``a: b; c: d`` -> pairs, ignoring ``;`` inside parentheses or quotes."""
+    declarations, current, depth, quote = [], [], 0, None
+    for char in text + ";":
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == ";" and depth == 0:
+            prop, _, value = "".join(current).partition(":")
+            if prop.strip() and value.strip():
+                declarations.append((prop.strip().lower(), " ".join(value.split())))
+            current = []
+            continue
+        current.append(char)
+    return declarations
+
+
+def _parse_css(css: str) -> List[object]:
+    """Top-level rules as ``_Rule``; at-rules are kept as raw strings."""
+    css = _CSS_COMMENT_RE.sub("", css)
+    items, pos, order = [], 0, 0
+    while True:
+        brace = css.find("{", pos)
+        prelude = css[pos:brace if brace != -1 else len(css)].strip()
+        if prelude.startswith("@") and ";" in prelude:
+            # @import / @charset: statement at-rules end at the semicolon
+            end = css.index(";", pos) + 1
+            items.append(css[pos:end].strip())
+            pos = end
+            continue
+        if brace == -1:
+            break
+        if prelude.startswith("@"):
+            depth, end = 0, brace
+            while end < len(css):
+                depth += {"{": 1, "}": -1}.get(css[end], 0)
+                end += 1
+                if depth == 0:
+                    break
+            items.append(prelude + _minify_css_block(css[brace:end]))
+            pos = end
+            continue
+        close = css.find("}", brace)
+        close = len(css) if close == -1 else close
+        items.append(_Rule([s.strip() for s in prelude.split(",") if s.strip()],
+                           _split_declarations(css[brace + 1:close]), order))
+        order += 1
+        pos = close + 1
+    return items
+
+
+def _minify_css_block(block: str) -> str:
+    block = " ".join(block.split())
+    return re.sub(r"\s*([{};:,])\s*", r"\1", block).replace(";}", "}")
+
+
+def _declarations_text(declarations) -> str:
+    return ";".join(f"{prop}:{value}" for prop, value in declarations)
+
+
+def _compile_selector(selector: str) -> Optional[List[Tuple[Optional[str], Optional[str], frozenset]]]:
+    """Descendant chain of ``(tag, id, classes)``, or ``None`` if not inlinable."""
+    chain = []
+    for part in selector.split():
+        match = _COMPOUND_RE.match(part)
+        if not match or not part:
+            return None
+        tag = match.group(1)
+        ids = re.findall(r"#([\w-]+)", match.group(2))
+        if len(ids) > 1:
+            return None
+        chain.append((None if tag in (None, "*") else tag.lower(),
+                      ids[0] if ids else None,
+                      frozenset(re.findall(r"\.([\w-]+)", match.group(2)))))
+    return chain or None
+
+
+def _specificity(chain) -> Tuple[int, int, int]:
+    return (sum(1 for _, i, _ in chain if i),
+            sum(len(c) for _, _, c in chain),
+            sum(1 for t, _, _ in chain if t))
+
+
+# ---------------------------------------------------------------- HTML
+
+
+@dataclass
+class _Element:
+    tag: str
+    attrs: List[Tuple[str, Optional[str]]]
+    start: int
+    end: int
+    parent: Optional[int]
+    self_closing: bool
+
+    @property
+    def id(self) -> Optional[str]:
+        return dict(self.attrs).get("id")
+
+    @property
+    def classes(self) -> frozenset:
+        return frozenset((dict(self.attrs).get("class") or "").split())
+
+
+class _Scanner(HTMLParser):
+    """Records every start tag's offsets and parent, plus ``<style>`` contents."""
+
+    def __init__(self, source: str):
+        super().__init__(convert_charrefs=False)
+        self._line_starts = [0] + [m.end() for m in re.finditer("\n", source)]
+        self.elements: List[_Element] = []
+        self.styles: List[Tuple[int, int, int]] = []  # (tag start, content start, content end)
+        self._stack: List[int] = []
+        self._style_open: Optional[Tuple[int, int]] = None
+        self.feed(source)
+        self.close()
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        self._add(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._add(tag, attrs, self_closing=True)
+
+    def _add(self, tag, attrs, self_closing):
+        start = self._offset()
+        end = start + len(self.get_starttag_text())
+        self.elements.append(_Element(tag, attrs, start, end,
+                                      self._stack[-1] if self._stack else None, self_closing))
+        if tag == "style":
+            self._style_open = (start, end)
+        elif not self_closing and tag not in _VOID_TAGS:
+            self._stack.append(len(self.elements) - 1)
+
+    def handle_endtag(self, tag):
+        if tag == "style" and self._style_open is not None:
+            self.styles.append((*self._style_open, self._offset()))
+            self._style_open = None
+            return
+        for depth in range(len(self._stack) - 1, -1, -1):
+            if self.elements[self._stack[depth]].tag == tag:
+                del self._stack[depth:]
+                break
+
+
+def _matches(elements: List[_Element], index: int, chain) -> bool:
+    def compound(element, part):
+        tag, id_, classes = part
+        return ((tag is None or element.tag == tag)
+                and (id_ is None or element.id == id_)
+                and classes <= element.classes)
+
+    element = elements[index]
+    if not compound(element, chain[-1]):
+        return False
+    ancestor = element.parent
+    for part in reversed(chain[:-1]):
+        while ancestor is not None and not compound(elements[ancestor], part):
+            ancestor = elements[ancestor].parent
+        if ancestor is None:
+            return False
+        ancestor = elements[ancestor].parent
+    return True
+
+
+def _start_tag(element: _Element, attrs) -> str:
+    parts = [element.tag]
+    for name, value in attrs:
+        if value is None:
+            parts.append(name)
+        else:
+            parts.append(f'{name}="{value.replace("&", "&amp;").replace(chr(34), "&quot;")}"')
+    return "<" + " ".join(parts) + (" />" if element.self_closing else ">")
+
+
+# ---------------------------------------------------------------- assets
+
+
+def _canonical_url(url: str) -> str:
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    netloc = parts.netloc.lower()
+    default_port = {"http": ":80", "https": ":443"}.get(parts.scheme.lower())
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path, parts.query, parts.fragment))
+
+
+def _minify_whitespace(html: str) -> str:
+    pieces = _PROTECTED_RE.split(html)
+    out = []
+    # split() with two groups yields: text, whole match, tag name, text, ...
+    for i, piece in enumerate(pieces):
+        if i % 3 == 0:
+            piece = _BLOCK_TAG_RE.sub(r"\1", re.sub(r"\s+", " ", piece))
+            out.append(piece)
+        elif i % 3 == 1:
+            out.append(piece)
+    return "".join(out).strip()
+
+
+# ---------------------------------------------------------------- pipeline
+
+
+def _optimize(source: str) -> OptimizedTemplate:
+    report = OptimizeReport(original_bytes=len(source.encode("utf-8")))
+    html = _HTML_COMMENT_RE.sub(
+        lambda m: m.group(0) if _CONDITIONAL_RE.search(m.group(0)) else "", source)
+    scan = _Scanner(html)
+    elements = scan.elements
+
+    # Parse every <style> block and decide, rule by rule, inline/keep/drop
+    inline: Dict[int, List[Tuple[Tuple[int, int, int], int, List[Tuple[str, str]]]]] = {}
+    kept_blocks: List[str] = []
+    order = 0
+    for _, content_start, content_end in scan.styles:
+        kept = []
+        for item in _parse_css(html[content_start:content_end]):
+            if isinstance(item, str):
+                kept.append(item)
+                report.kept_rules += 1
+                continue
+            order += 1
+            remaining = []
+            for selector in item.selectors:
+                chain = _compile_selector(selector)
+                if chain is not None:
+                    targets = [i for i in range(len(elements)) if _matches(elements, i, chain)]
+                    for i in targets:
+                        inline.setdefault(i, []).append((_specificity(chain), order,
+                                                         item.declarations))
+                    if targets:
+                        report.inlined_rules += 1
+                    else:
+                        report.removed_rules += 1
+                    continue
+                # Not inlinable: keep it only if its element part matches something
+                base = _compile_selector(_PSEUDO_RE.sub("", selector))
+                if base is not None and not any(_matches(elements, i, base)
+                                                for i in range(len(elements))):
+                    report.removed_rules += 1
+                else:
+                    remaining.append(selector)
+                    report.kept_rules += 1
+            if remaining and item.declarations:
+                kept.append((remaining, item.declarations))
+        kept_blocks.append(kept)
+
+    # An inline declaration beats any stylesheet rule that is not
+    # !important, so a kept rule (a :hover, say) restyling a property just
+    # inlined on an element it applies to is made !important to still win
+    inlined_props = {i: {prop for _, _, declarations in rules for prop, _ in declarations}
+                     for i, rules in inline.items()}
+
+    def kept_rule(selectors, declarations) -> str:
+        overridden = set()
+        for selector in selectors:
+            base = _compile_selector(_PSEUDO_RE.sub("", selector))
+            if base is None:
+                continue
+            for i, props in inlined_props.items():
+                if _matches(elements, i, base):
+                    overridden |= props
+        declarations = [(prop, value + "!important"
+                         if prop in overridden and not _IMPORTANT_RE.search(value) else value)
+                        for prop, value in declarations]
+        return ",".join(selectors) + "{" + _declarations_text(declarations) + "}"
+
+    def kept_at_rule(text: str) -> str:
+        # @media/@supports wrap ordinary rules, which must beat inlined
+        # values just the same; other at-rules hold no element selectors
+        if not _CONDITIONAL_GROUP_RE.match(text):
+            return text
+        brace = text.find("{")
+        inner = "".join(
+            kept_at_rule(item) if isinstance(item, str) else kept_rule(item.selectors, item.declarations)
+            for item in _parse_css(text[brace + 1:-1])
+            if isinstance(item, str) or (item.selectors and item.declarations))
+        return text[:brace + 1] + inner + "}"
+
+    kept_blocks = ["".join(kept_at_rule(item) if isinstance(item, str) else kept_rule(*item)
+                           for item in kept)
+                   for kept in kept_blocks]
+
+    used_classes = set(re.findall(r"\.([\w-]+)", "".join(kept_blocks)))
+
+    # Offsets are edited back to front so earlier ones stay valid
+    edits: List[Tuple[int, int, str]] = []
+    for (tag_start, content_start, content_end), css in zip(scan.styles, kept_blocks):
+        if css:
+            edits.append((content_start, content_end, css))
+        else:
+            close = html.find(">", content_end) + 1
+            edits.append((tag_start, close, ""))
+    for index, element in enumerate(elements):
+        if element.tag == "style":
+            continue
+        attrs = list(element.attrs)
+        changed = False
+        if index in inline:
+            merged = OrderedDict()
+            for _, _, declarations in sorted(inline[index], key=lambda r: (r[0], r[1])):
+                for prop, value in declarations:
+                    merged.pop(prop, None)
+                    merged[prop] = value
+            existing = dict(attrs).get("style")
+            for prop, value in _split_declarations(existing or ""):
+                merged.pop(prop, None)
+                merged[prop] = value
+            style = _declarations_text(merged.items())
+            attrs = [(n, v) for n, v in attrs if n != "style"] + [("style", style)]
+            changed = True
+        if element.classes:
+            classes = [c for c in (dict(attrs).get("class") or "").split() if c in used_classes]
+            attrs = [(n, " ".join(classes) if n == "class" else v) for n, v in attrs
+                     if n != "class" or classes]
+            changed = True
+        if changed:
+            edits.append((element.start, element.end, _start_tag(element, attrs)))
+    for start, end, text in sorted(edits, reverse=True):
+        html = html[:start] + text + html[end:]
+
+    # One spelling per asset, so clients fetch (and cache) it once
+    counts: Counter = Counter()
+
+    def dedupe(url: str) -> str:
+        canonical = _canonical_url(url)
+        counts[canonical] += 1
+        return canonical
+
+    html = re.sub(r"""(\s(?:src|background)=)(["'])(.*?)\2""",
+                  lambda m: m.group(1) + m.group(2) + dedupe(m.group(3)) + m.group(2), html)
+    html = _CSS_URL_RE.sub(lambda m: f"url({m.group(1)}{dedupe(m.group(2))}{m.group(1)})", html)
+    report.repeated_assets = {url: n for url, n in counts.items() if n > 1}
+
+    html = _minify_whitespace(html)
+    report.optimized_bytes = len(html.encode("utf-8"))
+    return OptimizedTemplate(source, html, report)
+
+
+_optimized = OrderedDict()
+_optimized_lock = threading.Lock()
+
+
+def optimize_template(source: str) -> OptimizedTemplate:
+    """Optimize ``source``, reusing the result for identical content."""
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    with _optimized_lock:
+        optimized = _optimized.get(key)
+        if optimized is not None:
+            _optimized.move_to_end(key)
+            return optimized
+    optimized = _optimize(source)
+    with _optimized_lock:
+        _optimized[key] = optimized
+        if len(_optimized) > _CACHE_SIZE:
+            _optimized.popitem(last=False)
+    return optimized
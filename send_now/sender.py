@@ -0,0 +1,553 @@
+"""Webhook dispatch engine.
+
+Payloads are posted from a bounded thread pool so one slow webhook response
+no longer stalls every row behind it. Results are yielded as requests finish,
+each tagged with the key it was submitted under so callers can match them
+back to their rows.
+"""
+import inspect
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from functools import partial
+from typing import Any, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from send_now.endpoints import EndpointPool
+from send_now.metrics import SendMetrics
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 64
+DEFAULT_CONNECT_RETRIES = 2
+# Hosts with their own keep-alive pool; more are reopened on every switch
+DEFAULT_HOST_POOLS = 4
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_ATTEMPTS = 4
+
+# A single webhook URL, or a pool of them
+Target = Union[str, EndpointPool]
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# len('{"recipients": []}')
+_BATCH_ENVELOPE_BYTES = 18
+
+# (url, template_id) pairs the webhook has already accepted in this process
+_registered_templates = set()
+_registered_lock = threading.Lock()
+
+
+def make_session(pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_retries: int = DEFAULT_CONNECT_RETRIES,
+                 backoff_factor: float = 0.3,
+                 hosts: int = DEFAULT_HOST_POOLS) -> requests.Session:
+    """Build a keep-alive session with a connection pool sized for dispatch.
+
+    ``pool_size`` connections are kept per host, for up to ``hosts`` hosts
+    (at least every endpoint of a pool, or they evict each other's pools).
+
+    Only connection-level failures are retried here: the request never
+    reached the webhook, so retrying cannot produce a duplicate email.
+    """
+    retry = Retry(
+        total=connect_retries,
+        connect=connect_retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=backoff_factor,
+        allowed_methods=None,
+        # Status handling (429, Retry-After) belongs to post_payload
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max(DEFAULT_HOST_POOLS, hosts),
+                          pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@dataclass
+class SendResult:
+    key: Any
+    ok: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    response_text: str = ""
+    attempts: int = 1
+    bytes_sent: int = 0
+    # Not sent: the send ledger says this recipient already got it
+    skipped: bool = False
+
+    @property
+    def status(self) -> str:
+        # Same wording the results table has always used
+        if self.skipped:
+            return "⏭️ Already sent"
+        if self.ok:
+            return "✅ Success"
+        if self.status_code is not None:
+            return f"❌ Error {self.status_code}"
+        return f"❌ {(self.error or 'Unknown error')[:50]}"
+
+
+class RateLimiter:
+    """Token bucket shared by all dispatch threads, adapting to push-back.
+
+    ``rate`` is the ceiling in requests per second (``None`` for no
+    ceiling). A 429/503 halves the current rate and, with ``Retry-After``,
+    pauses every sender until that time; successes then win back 5% of the
+    ceiling per second, so the rate settles just below what the webhook
+    accepts. Without a ceiling, the first push-back starts the bucket from
+    the request rate observed so far, and the limit is lifted again once
+    the rate has climbed back to it.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None,
+                 min_rate: float = 0.5):
+        self.max_rate = rate if rate and rate > 0 else None
+        self.rate = self.max_rate
+        self.min_rate = min(min_rate, self.max_rate) if self.max_rate else min_rate
+        # A tenth of a second's worth of requests may go out back to back
+        self.burst = burst or (max(1, int(self.max_rate / 10)) if self.max_rate else 1)
+        self._fixed_burst = burst is not None
+        # Rate learned at the first push-back when there is no ceiling
+        self._learned_rate: Optional[float] = None
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_penalty = float("-inf")
+        # Requests per second actually sent, measured over ~1s windows
+        self._observed = 0.0
+        self._window_start = self._updated
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def _count(self, now: float) -> None:
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self._observed = self._window_count / elapsed
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait_for = self._paused_until - now
+                elif self.rate is None:
+                    self._count(now)
+                    return
+                else:
+                    self._tokens = min(self.burst,
+                                       self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._count(now)
+                        return
+                    wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+    def penalize(self, retry_after: Optional[float] = None) -> None:
+        """The webhook pushed back: slow down, and pause if it said how long."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is None:
+                # No ceiling yet: start from what is actually being sent
+                current = self._window_count / max(1.0, now - self._window_start)
+                self._learned_rate = max(2 * self.min_rate, self._observed, current)
+                self.rate = self._learned_rate
+                if not self._fixed_burst:
+                    self.burst = max(1, int(self.rate / 10))
+            # Requests in flight together get rejected together; that is one
+            # congestion signal, so halve at most once per second
+            if now - self._last_penalty >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = 0.0
+                self._updated = now
+                self._last_penalty = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def reward(self) -> None:
+        with self._lock:
+            if self.rate is None:
+                return
+            ceiling = self.max_rate or self._learned_rate
+            if self.rate < ceiling:
+                # About ``rate`` successes arrive per second, so this climbs
+                # back by 5% of the ceiling per second
+                self.rate = min(ceiling, self.rate + ceiling * 0.05 / self.rate)
+            elif self.max_rate is None:
+                # Back where the push-back started; probe for more again
+                self.rate = None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Which failures are retried, and how long to back off between tries.
+
+    Timeouts are retried too, so a slow webhook that did process the first
+    attempt can receive a recipient twice.
+    """
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_statuses: FrozenSet[int] = field(
+        default_factory=lambda: frozenset({408, 425, 429, 500, 502, 503, 504}))
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given (1-based) attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+# Statuses that mean "you are sending too fast", not "this request is bad"
+_THROTTLE_STATUSES = frozenset({429, 503})
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def post_payload(url: Target, payload: Union[dict, bytes], key: Any = None,
+                 timeout: float = DEFAULT_TIMEOUT, session=None,
+                 limiter: Optional[RateLimiter] = None,
+                 retry: RetryPolicy = NO_RETRY,
+                 metrics: Optional[SendMetrics] = None) -> SendResult:
+    """POST one payload and turn the outcome into a SendResult (never raises).
+
+    Transient failures are retried per ``retry``; every attempt first takes
+    a token from ``limiter`` and, when given, is recorded in ``metrics``.
+    ``url`` may be an :class:`EndpointPool`, which picks the endpoint for
+    each attempt, so a retry can land on a different one. ``payload`` may
+    also be JSON already encoded to bytes (e.g. a pre-rendered body).
+    """
+    http = session if session is not None else requests
+    pool = url if isinstance(url, EndpointPool) else None
+    started = time.perf_counter()
+    # Encoded once, so retries resend the same bytes and the size is known
+    try:
+        body = payload if isinstance(payload, bytes) else \
+            json.dumps(payload, allow_nan=False).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        return SendResult(key, False, error=str(e), attempts=0,
+                          elapsed=time.perf_counter() - started)
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire()
+        endpoint = pool.acquire() if pool is not None else None
+        attempt_started = time.perf_counter()
+        try:
+            response = http.post(endpoint.url if endpoint is not None else url,
+                                 data=body, headers=_JSON_HEADERS, timeout=timeout)
+            status_code, error, retryable = response.status_code, None, None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            status_code, error, retryable = None, e, True
+        except Exception as e:
+            status_code, error, retryable = None, e, False
+
+        elapsed = time.perf_counter() - attempt_started
+        if metrics is not None:
+            metrics.observe(status_code, elapsed, len(body))
+        if endpoint is not None:
+            pool.release(endpoint, status_code, elapsed)
+
+        if error is not None:
+            if retryable and attempt < retry.max_attempts:
+                time.sleep(retry.backoff(attempt))
+                continue
+            return SendResult(key, False, error=str(error), attempts=attempt,
+                              elapsed=time.perf_counter() - started,
+                              bytes_sent=len(body) * attempt)
+
+        if status_code in _THROTTLE_STATUSES and limiter is not None:
+            limiter.penalize(_retry_after(response))
+        if status_code in retry.retry_statuses and attempt < retry.max_attempts:
+            retry_after = _retry_after(response)
+            time.sleep(min(retry.max_delay, retry_after) if retry_after is not None
+                       else retry.backoff(attempt))
+            continue
+        if status_code == 200 and limiter is not None:
+            limiter.reward()
+        return SendResult(
+            key,
+            status_code == 200,
+            status_code=status_code,
+            elapsed=time.perf_counter() - started,
+            response_text=response.text,
+            attempts=attempt,
+            bytes_sent=len(body) * attempt,
+        )
+
+
+class _StopDispatch(Exception):
+    """Thrown into a dispatch generator by :func:`drain`."""
+
+
+def _bounded_map(fn, arg_tuples: Iterable[tuple], concurrency: int) -> Iterator:
+    """Run ``fn(*args)`` on a thread pool, yielding results as they finish.
+
+    Only ``2 * concurrency`` argument tuples are pulled ahead of the
+    workers, so a lazy generator over a large contact list is never
+    materialized all at once. Closing the generator cancels the calls that
+    have not started; :func:`drain` also collects the ones that have.
+    """
+    concurrency = max(1, int(concurrency))
+    window = concurrency * 2
+    arg_tuples = iter(arg_tuples)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                # Top up the in-flight window
+                while not exhausted and len(pending) < window:
+                    try:
+                        args = next(arg_tuples)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(fn, *args))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done = list(done)
+                while done:
+                    try:
+                        yield done.pop().result()
+                    except _StopDispatch:
+                        # Queued calls are dropped, running ones still reported
+                        exhausted = True
+                        pending = {future for future in pending if not future.cancel()}
+        finally:
+            # Otherwise the pool would wait for, and run, every queued call
+            for future in pending:
+                future.cancel()
+
+
+def drain(results: Iterator[SendResult]) -> List[SendResult]:
+    """Stop a :func:`dispatch` or :func:`dispatch_batches` run early.
+
+    Requests that have not started are cancelled. Those already under way
+    are waited for, and their results returned, since they may well have
+    been delivered. A finished or never-started run returns nothing.
+    """
+    if inspect.getgeneratorstate(results) != inspect.GEN_SUSPENDED:
+        results.close()
+        return []
+    drained = []
+    try:
+        drained.append(results.throw(_StopDispatch()))
+        drained.extend(results)
+    except StopIteration:
+        pass
+    return drained
+
+
+def dispatch(items: Iterable[Tuple[Any, dict]], url: Target,
+             concurrency: int = DEFAULT_CONCURRENCY,
+             timeout: float = DEFAULT_TIMEOUT,
+             session=None,
+             limiter: Optional[RateLimiter] = None,
+             retry: RetryPolicy = NO_RETRY,
+             metrics: Optional[SendMetrics] = None) -> Iterator[SendResult]:
+    """Send ``(key, payload)`` pairs with at most ``concurrency`` in flight.
+
+    Results come back in completion order.
+    """
+    return _bounded_map(
+        partial(post_payload, limiter=limiter, retry=retry, metrics=metrics),
+        ((url, payload, key, timeout, session) for key, payload in items),
+        concurrency,
+    )
+
+
+def iter_batches(items: Iterable[Tuple[Any, dict]],
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_bytes: int = DEFAULT_BATCH_MAX_BYTES) -> Iterator[Tuple[list, list]]:
+    """Group ``(key, payload)`` pairs into ``(keys, payloads)`` batches.
+
+    A batch is closed once it holds ``batch_size`` recipients or adding the
+    next payload would push the encoded body past ``max_bytes``. A single
+    payload larger than ``max_bytes`` is still sent, on its own.
+    """
+    batch_size = max(1, int(batch_size))
+    keys, payloads, size = [], [], _BATCH_ENVELOPE_BYTES
+    for key, payload in items:
+        # +1 for the comma separating array elements
+        payload_size = len(json.dumps(payload).encode("utf-8")) + 1
+        if payloads and (len(payloads) >= batch_size or size + payload_size > max_bytes):
+            yield keys, payloads
+            keys, payloads, size = [], [], _BATCH_ENVELOPE_BYTES
+        keys.append(key)
+        payloads.append(payload)
+        size += payload_size
+    if payloads:
+        yield keys, payloads
+
+
+def _per_recipient_results(body: Any) -> Optional[list]:
+    # Accept either a bare JSON array or {"results": [...]}
+    if isinstance(body, dict):
+        body = body.get("results")
+    return body if isinstance(body, list) else None
+
+
+def _entry_ok(entry: Any) -> Tuple[bool, Optional[int], Optional[str]]:
+    if not isinstance(entry, dict):
+        return bool(entry), None, None
+    code = entry.get("status_code", entry.get("status"))
+    code = code if isinstance(code, int) else None
+    if "ok" in entry:
+        ok = bool(entry["ok"])
+    elif "success" in entry:
+        ok = bool(entry["success"])
+    else:
+        ok = code == 200 if code is not None else "error" not in entry
+    error = entry.get("error")
+    if error is None and not ok and code is None:
+        error = "Rejected by webhook"
+    return ok, code, str(error) if error is not None else None
+
+
+def post_batch(url: Target, keys: list, payloads: list,
+               timeout: float = DEFAULT_TIMEOUT, session=None,
+               limiter: Optional[RateLimiter] = None,
+               retry: RetryPolicy = NO_RETRY,
+               metrics: Optional[SendMetrics] = None) -> list:
+    """POST many recipients as ``{"recipients": [...]}`` in one request.
+
+    The webhook may answer with one entry per recipient, either as a JSON
+    array or under ``"results"``, matched by ``"email"`` or else by position.
+    Each entry can carry ``ok``/``success``, ``status``/``status_code`` and
+    ``error``. Recipients without an entry inherit the status of the batch.
+    """
+    batch = post_payload(url, {"recipients": payloads}, None, timeout, session,
+                         limiter=limiter, retry=retry, metrics=metrics)
+    results = [
+        SendResult(key, batch.ok, batch.status_code, batch.error, batch.elapsed,
+                   attempts=batch.attempts)
+        for key in keys
+    ]
+    if not batch.ok:
+        return results
+
+    try:
+        entries = _per_recipient_results(json.loads(batch.response_text))
+    except ValueError:
+        entries = None
+    if not entries:
+        return results
+
+    by_email = {
+        entry["email"]: entry for entry in entries
+        if isinstance(entry, dict) and "email" in entry
+    }
+    if by_email:
+        matched = [by_email.get(payload.get("email")) for payload in payloads]
+    elif len(entries) == len(payloads):
+        matched = entries
+    else:
+        return results
+
+    for result, entry in zip(results, matched):
+        if entry is None:
+            continue
+        result.ok, code, result.error = _entry_ok(entry)
+        result.status_code = code if code is not None else (
+            result.status_code if result.ok else None)
+    return results
+
+
+def dispatch_batches(items: Iterable[Tuple[Any, dict]], url: Target,
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+                     concurrency: int = DEFAULT_CONCURRENCY,
+                     timeout: float = DEFAULT_TIMEOUT,
+                     session=None,
+                     limiter: Optional[RateLimiter] = None,
+                     retry: RetryPolicy = NO_RETRY,
+                     metrics: Optional[SendMetrics] = None) -> Iterator[SendResult]:
+    """Like :func:`dispatch`, but many recipients share each request.
+
+    Results are still yielded one per recipient.
+    """
+    batches = _bounded_map(
+        partial(post_batch, limiter=limiter, retry=retry, metrics=metrics),
+        ((url, keys, payloads, timeout, session)
+         for keys, payloads in iter_batches(items, batch_size, max_bytes)),
+        concurrency,
+    )
+    for results in batches:
+        for i, result in enumerate(results):
+            try:
+                yield result
+            except _StopDispatch:
+                # The rest of this batch was sent along with it
+                yield from results[i + 1:]
+                for rest in drain(batches):
+                    yield from rest
+                return
+
+
+def register_template(url: Target, template_id: str, html: str,
+                      timeout: float = DEFAULT_TIMEOUT, session=None,
+                      force: bool = False) -> Optional[SendResult]:
+    """Upload a template once so recipient payloads can reference it by hash.
+
+    Returns ``None`` when this process already registered the template with
+    ``url``; pass ``force=True`` to upload again (e.g. after a webhook
+    restart dropped its template store). With a pool, the template is
+    uploaded to every endpoint and the first failure is returned.
+    """
+    if isinstance(url, EndpointPool):
+        last = None
+        for endpoint_url in url.urls:
+            result = register_template(endpoint_url, template_id, html, timeout, session, force)
+            if result is not None and not result.ok:
+                return result
+            last = result or last
+        return last
+    with _registered_lock:
+        if not force and (url, template_id) in _registered_templates:
+            return None
+    result = post_payload(
+        url,
+        {"action": "register_template", "template_id": template_id,
+         "html_template": html},
+        template_id, timeout, session,
+    )
+    if result.ok:
+        with _registered_lock:
+            _registered_templates.add((url, template_id))
+    return result
@@ -0,0 +1,270 @@
+"""Incremental contact sync to Google Sheets through an Apps Script web app.
+
+Only rows that are new or changed since the last successful sync are sent.
+A manifest (SQLite) remembers, per sheet, a hash of every row keyed by
+email; a row whose email is unknown is appended, one whose hash differs is
+updated, everything else is skipped. Rows go out in batches, one request
+per batch, using the same HTTP transport and retry policy as the sender.
+
+The web app (see ``apps_script/Code.gs``) accepts POSTed JSON::
+
+    {"action": "append" | "update", "sheet": "Contacts",
+     "columns": ["name", "email", ...], "key": "email", "rows": [[...], ...]}
+
+and answers ``{"ok": true}``. ``update`` rewrites the rows whose ``key``
+column matches, appending any it cannot find. Columns are matched to the
+sheet's header by name, and missing ones are added to it. New rows are
+sent as ``update`` too: Apps Script holds its lock for up to 30 s, longer
+than the client timeout, so a retried ``append`` could add them twice.
+"""
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from send_now.sender import DEFAULT_TIMEOUT, RetryPolicy, SendResult, post_payload
+
+DEFAULT_MANIFEST_PATH = "sheets_manifest.sqlite3"
+DEFAULT_SHEET = "Contacts"
+DEFAULT_BATCH_ROWS = 500
+KEY_COLUMN = "email"
+STATUS_SHEET = "Delivery Status"
+STATUS_COLUMNS = ["email", "name", "status", "http_code", "sent_at", "latency_ms", "attempts", "job_id"]
+STATUS_FLUSH_SECONDS = 10.0
+
+
+@dataclass
+class SyncReport:
+    appended: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    requests: int = 0
+    errors: Optional[List[str]] = None
+
+    @property
+    def sent(self) -> int:
+        return self.appended + self.updated
+
+
+def post_rows(url: str, action: str, sheet: str, columns: List[str], rows: List[list],
+              timeout: float = DEFAULT_TIMEOUT, session=None,
+              retry: RetryPolicy = RetryPolicy()) -> SendResult:
+    """Send one batch of rows to the web app."""
+    payload = {"action": action, "sheet": sheet, "columns": columns,
+               "key": KEY_COLUMN, "rows": rows}
+    result = post_payload(url, payload, action, timeout, session, retry=retry)
+    # Apps Script answers 200 even when the script itself failed
+    if result.ok:
+        try:
+            body = json.loads(result.response_text)
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and body.get("ok") is False:
+            result.ok = False
+            result.error = str(body.get("error") or "Apps Script error")
+    return result
+
+
+def row_hashes(df: pd.DataFrame, columns: Sequence[str]) -> pd.Series:
+    """Stable 64-bit hash of each row's values in ``columns``."""
+    hashes = pd.util.hash_pandas_object(df[list(columns)].astype(str), index=False)
+    # SQLite integers are signed
+    return pd.Series(hashes.to_numpy().view("int64"), index=df.index)
+
+
+class SyncManifest:
+    """Per-sheet record of the row hash last written for each key."""
+
+    def __init__(self, path: str = DEFAULT_MANIFEST_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS synced_rows ("
+            "sheet TEXT NOT NULL, key TEXT NOT NULL, row_hash INTEGER NOT NULL, "
+            "PRIMARY KEY (sheet, key))"
+        )
+        self._lock = threading.Lock()
+
+    def load(self, sheet: str) -> pd.Series:
+        """``key -> row_hash`` for everything synced to ``sheet``."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, row_hash FROM synced_rows WHERE sheet = ?", (sheet,)
+            ).fetchall()
+        if not rows:
+            return pd.Series(dtype="int64")
+        keys, hashes = zip(*rows)
+        return pd.Series(hashes, index=keys, dtype="int64")
+
+    def save(self, sheet: str, keys: Sequence[str], hashes: Sequence[int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO synced_rows (sheet, key, row_hash) VALUES (?, ?, ?)",
+                [(sheet, key, int(h)) for key, h in zip(keys, hashes)],
+            )
+
+    def forget(self, sheet: str) -> None:
+        """Drop the manifest so the next sync re-sends every row."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM synced_rows WHERE sheet = ?", (sheet,))
+
+
+class SheetSync:
+    def __init__(self, url: str, manifest: SyncManifest, sheet: str = DEFAULT_SHEET,
+                 batch_rows: int = DEFAULT_BATCH_ROWS, timeout: float = DEFAULT_TIMEOUT,
+                 session=None, retry: RetryPolicy = RetryPolicy()):
+        self.url = url
+        self.manifest = manifest
+        self.sheet = sheet
+        self.batch_rows = max(1, int(batch_rows))
+        self.timeout = timeout
+        self.session = session
+        self.retry = retry
+
+    def sync(self, df: pd.DataFrame, extra: Optional[Dict[str, str]] = None,
+             on_progress: Optional[Callable[[int, int], None]] = None) -> SyncReport:
+        """Send new and changed rows of ``df`` in batches.
+
+        ``extra`` holds constant columns (e.g. ``uploaded_at``) that are
+        written with every sent row but left out of the change hash.
+        """
+        columns = list(df.columns)
+        hashes = row_hashes(df, columns)
+        keys = df[KEY_COLUMN]
+        known = self.manifest.load(self.sheet)
+        previous = keys.map(known)
+
+        is_new = previous.isna()
+        is_changed = ~is_new & (previous != hashes)
+        report = SyncReport(unchanged=int((~is_new & ~is_changed).sum()), errors=[])
+
+        extra = extra or {}
+        out_columns = columns + list(extra)
+        pending = [("append", is_new), ("update", is_changed)]
+        total = int(is_new.sum() + is_changed.sum())
+        done = 0
+
+        for action, mask in pending:
+            selected = df[mask]
+            if extra:
+                selected = selected.assign(**extra)
+            selected_hashes = hashes[mask]
+            for start in range(0, len(selected), self.batch_rows):
+                batch = selected.iloc[start:start + self.batch_rows]
+                # "update" inserts rows it cannot find, so a retry after a
+                # timeout never duplicates them as a second "append" would
+                result = post_rows(self.url, "update", self.sheet, out_columns,
+                                   batch.astype(str).to_numpy().tolist(),
+                                   self.timeout, self.session, self.retry)
+                report.requests += 1
+                if result.ok:
+                    self.manifest.save(self.sheet, batch[KEY_COLUMN].tolist(),
+                                       selected_hashes.iloc[start:start + self.batch_rows].tolist())
+                    if action == "append":
+                        report.appended += len(batch)
+                    else:
+                        report.updated += len(batch)
+                else:
+                    report.failed += len(batch)
+                    report.errors.append(result.status)
+                done += len(batch)
+                if on_progress is not None:
+                    on_progress(done, total)
+        return report
+
+
+class StatusWriter:
+    """Buffers per-recipient delivery results and writes them in bulk.
+
+    Rows are flushed to the status sheet (one row per email, updated in
+    place) from a background thread once ``batch_rows`` are waiting or
+    ``flush_seconds`` have passed, and on :meth:`close`, so a slow Apps
+    Script call never holds up the send loop that adds them. A failed
+    flush keeps its rows for the next one; the oldest are dropped once ten
+    batches' worth are backed up.
+    """
+
+    def __init__(self, url: str, sheet: str = STATUS_SHEET,
+                 batch_rows: int = DEFAULT_BATCH_ROWS,
+                 flush_seconds: float = STATUS_FLUSH_SECONDS,
+                 timeout: float = DEFAULT_TIMEOUT, session=None,
+                 retry: RetryPolicy = RetryPolicy()):
+        self.url = url
+        self.sheet = sheet
+        self.batch_rows = max(1, int(batch_rows))
+        self.flush_seconds = flush_seconds
+        self.timeout = timeout
+        self.session = session
+        self.retry = retry
+        self.written = 0
+        self.dropped = 0
+        self.requests = 0
+        self.errors: List[str] = []
+        self._buffer: List[list] = []
+        self._closed = False
+        # After a failed flush, wait out flush_seconds before trying again
+        self._backing_off = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, job_id: str, name: str, email: str, result: SendResult) -> None:
+        row = [
+            email,
+            name,
+            "skipped" if result.skipped else "sent" if result.ok else "failed",
+            "" if result.status_code is None else result.status_code,
+            datetime.now().isoformat(timespec="seconds"),
+            round(result.elapsed * 1000),
+            result.attempts,
+            job_id,
+        ]
+        with self._cond:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_rows:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or (not self._backing_off
+                                             and len(self._buffer) >= self.batch_rows),
+                    timeout=self.flush_seconds)
+                closed = self._closed
+            self._flush()
+            if closed:
+                return
+
+    def _flush(self) -> None:
+        while True:
+            with self._cond:
+                batch = self._buffer[:self.batch_rows]
+            if not batch:
+                return
+            # Outside the lock, so add() never waits on the sheet
+            result = post_rows(self.url, "update", self.sheet, STATUS_COLUMNS, batch,
+                               self.timeout, self.session, self.retry)
+            with self._cond:
+                self.requests += 1
+                self._backing_off = not result.ok
+                if not result.ok:
+                    self.errors.append(result.status)
+                    backlog = len(self._buffer) - self.batch_rows * 10
+                    if backlog > 0:
+                        del self._buffer[:backlog]
+                        self.dropped += backlog
+                    return
+                del self._buffer[:len(batch)]
+                self.written += len(batch)
+
+    def close(self) -> None:
+        """Write what is still buffered and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
@@ -0,0 +1,136 @@
+"""Process-wide store of uploaded contact lists.
+
+Each validated upload is kept once, in compact column form, under a key
+derived from the file's content hash; browser sessions only hold that key.
+Derived data that used to be rebuilt per session (search results, as row
+positions, and the CSV export) is cached on the dataset too and counted in
+its size. Datasets idle for longer than the TTL, or the least recently
+used ones once the byte budget is exceeded, are evicted.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from send_now.contacts import search_mask
+
+DEFAULT_STORE_BYTES = 1024 * 1024 * 1024
+DEFAULT_TTL = 2 * 3600
+SEARCHES_PER_DATASET = 8
+
+
+@dataclass
+class Dataset:
+    key: str
+    contacts: pd.DataFrame
+    meta: dict = field(default_factory=dict)
+    nbytes: int = 0
+    last_access: float = 0.0
+    csv: Optional[bytes] = None
+    # Query -> positions of the matching rows
+    searches: "OrderedDict[str, np.ndarray]" = field(default_factory=OrderedDict)
+
+
+class DatasetStore:
+    def __init__(self, max_bytes: int = DEFAULT_STORE_BYTES, ttl: float = DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._datasets: "OrderedDict[str, Dataset]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._datasets)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def put(self, key: str, contacts: pd.DataFrame, **meta) -> Dataset:
+        """Store ``contacts`` under ``key``, replacing any previous entry.
+
+        The frame is kept as given (ingest results are already compact) and
+        must not be modified afterwards.
+        """
+        dataset = Dataset(key, contacts, meta,
+                          int(contacts.memory_usage(deep=True).sum()), time.monotonic())
+        with self._lock:
+            self._drop(key)
+            self._datasets[key] = dataset
+            self._bytes += dataset.nbytes
+            self._evict()
+        return dataset
+
+    def get(self, key: Optional[str]) -> Optional[Dataset]:
+        if key is None:
+            return None
+        with self._lock:
+            self._evict()
+            dataset = self._datasets.get(key)
+            if dataset is not None:
+                dataset.last_access = time.monotonic()
+                self._datasets.move_to_end(key)
+            return dataset
+
+    def search(self, key: str, query: str) -> Optional[pd.DataFrame]:
+        """Cached :func:`search_contacts` over a stored dataset."""
+        dataset = self.get(key)
+        if dataset is None:
+            return None
+        query = (query or "").strip()
+        if not query:
+            return dataset.contacts
+        with self._lock:
+            positions = dataset.searches.get(query)
+            if positions is not None:
+                dataset.searches.move_to_end(query)
+        if positions is None:
+            positions = np.flatnonzero(search_mask(dataset.contacts, query).to_numpy())
+            with self._lock:
+                if self._datasets.get(key) is dataset and query not in dataset.searches:
+                    dataset.searches[query] = positions
+                    self._resize(dataset, positions.nbytes)
+                    if len(dataset.searches) > SEARCHES_PER_DATASET:
+                        _, evicted = dataset.searches.popitem(last=False)
+                        self._resize(dataset, -evicted.nbytes)
+                    self._evict()
+        return dataset.contacts.iloc[positions]
+
+    def csv_bytes(self, key: str) -> Optional[bytes]:
+        """The dataset as CSV, built on first request and then kept."""
+        dataset = self.get(key)
+        if dataset is None:
+            return None
+        if dataset.csv is None:
+            csv = dataset.contacts.to_csv(index=False).encode("utf-8")
+            with self._lock:
+                if dataset.csv is None and key in self._datasets:
+                    dataset.csv = csv
+                    self._resize(dataset, len(csv))
+                    self._evict()
+            return csv
+        return dataset.csv
+
+    def _resize(self, dataset: Dataset, delta: int) -> None:
+        dataset.nbytes += delta
+        self._bytes += delta
+
+    def _drop(self, key: str) -> None:
+        dataset = self._datasets.pop(key, None)
+        if dataset is not None:
+            self._bytes -= dataset.nbytes
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, d in self._datasets.items() if now - d.last_access > self.ttl]:
+            self._drop(key)
+        # Least recently used first, but never the only dataset left
+        while self._bytes > self.max_bytes and len(self._datasets) > 1:
+            self._drop(next(iter(self._datasets)))
@@ -0,0 +1,97 @@
+"""Email template helpers.
+
+Templates use ``{column}`` placeholders that are filled from a contact's
+CSV columns. A template is compiled once into alternating literal and
+placeholder segments, so rendering a recipient is a single ``"".join``
+instead of one full-string scan per placeholder.
+"""
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from typing import Mapping, Tuple
+
+# {name}, {email}, {first_name} ... but not CSS blocks like "p { margin: 0 }"
+PLACEHOLDER_RE = re.compile(r"\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}")
+
+_COMPILED_CACHE_SIZE = 32
+
+
+def template_hash(source: str) -> str:
+    """Content hash a template is registered and referenced under."""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class CompiledTemplate:
+    """A template pre-split into literal segments and placeholder slots."""
+
+    def __init__(self, source: str, template_id: str = None):
+        self.source = source
+        self.template_id = template_id or template_hash(source)
+
+        parts = []
+        slots = []
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            parts.append(source[pos:match.start()])
+            # Column names are lower-cased on upload, so {Name} means "name"
+            slots.append((len(parts), match.group(1).lower()))
+            parts.append(match.group(0))
+            pos = match.end()
+        parts.append(source[pos:])
+
+        self._parts = parts
+        self._slots = tuple(slots)
+        self.fields: Tuple[str, ...] = tuple(dict.fromkeys(f for _, f in slots))
+
+    def render(self, values: Mapping, escape: bool = True) -> str:
+        """Fill placeholders from ``values``; unknown ones are left as written."""
+        parts = self._parts.copy()
+        for index, field in self._slots:
+            value = values.get(field)
+            if value is None:
+                continue
+            value = str(value)
+            parts[index] = html.escape(value) if escape else value
+        return "".join(parts)
+
+    def merge_vars(self, values: Mapping) -> dict:
+        """The subset of ``values`` this template actually references."""
+        return {f: str(values[f]) for f in self.fields if values.get(f) is not None}
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compile_template(source: str) -> CompiledTemplate:
+    """Compile ``source``, reusing an earlier compile of identical content."""
+    template_id = template_hash(source)
+    with _compiled_lock:
+        compiled = _compiled.get(template_id)
+        if compiled is not None:
+            _compiled.move_to_end(template_id)
+            return compiled
+    compiled = CompiledTemplate(source, template_id)
+    with _compiled_lock:
+        _compiled[template_id] = compiled
+        if len(_compiled) > _COMPILED_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def reference_payload(template_id: str, subject: str, email: str,
+                      merge_vars: dict) -> dict:
+    """Recipient payload that points at a registered template.
+
+    The webhook looks the template up by ``template_id`` and renders it with
+    ``merge_vars`` itself, so only a few hundred bytes travel per recipient.
+    """
+    return {
+        "subject": subject,
+        "email": email,
+        "name": merge_vars.get("name", ""),
+        "template_id": template_id,
+        "merge_vars": merge_vars,
+    }
@@ -0,0 +1,181 @@
+"""Background send worker.
+
+A single daemon thread owns the send queue and runs journaled jobs one
+after another, so a campaign is no longer tied to the Streamlit script run
+that started it. Callers enqueue a job id and poll its progress.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+from send_now.jobs import FAILED, PENDING, SENT, SKIPPED, JobError, JobJournal, run_job
+from send_now.ledger import SendLedger
+from send_now.metrics import SendMetrics
+from send_now.sender import DEFAULT_POOL_SIZE, make_session
+
+# Worker-side job states
+QUEUED = "queued"
+RENDERING = "rendering"
+RUNNING = "running"
+DONE = "done"
+PAUSED = "paused"
+ERROR = "error"
+ACTIVE_STATES = (QUEUED, RENDERING, RUNNING)
+
+
+@dataclass
+class JobProgress:
+    job_id: str
+    state: str = QUEUED
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # Already sent by another job, per the send ledger
+    skipped: int = 0
+    # Results received in this run, used for the rate
+    completed_this_run: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.skipped
+
+    @property
+    def rate(self) -> float:
+        """Results per second since the job (re)started."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.completed_this_run / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Seconds until every recipient has a result, at the current rate."""
+        rate = self.rate
+        if self.state != RUNNING or rate <= 0:
+            return None
+        return (self.total - self.done) / rate
+
+
+class SendWorker:
+    def __init__(self, journal: JobJournal, metrics: Optional[SendMetrics] = None,
+                 ledger: Optional[SendLedger] = None):
+        self.journal = journal
+        self.metrics = metrics
+        self.ledger = ledger
+        self._queue = queue.Queue()
+        self._progress: Dict[str, JobProgress] = {}
+        self._pause_requested = set()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="send-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, job_id: str) -> None:
+        """Queue a journaled job; re-submitting an unfinished job resumes it."""
+        with self._lock:
+            current = self._progress.get(job_id)
+            if current is not None and current.state in ACTIVE_STATES:
+                return
+            counts = self.journal.counts(job_id)
+            self._progress[job_id] = JobProgress(
+                job_id, total=sum(counts.values()), sent=counts[SENT],
+                skipped=counts[SKIPPED])
+            self._pause_requested.discard(job_id)
+        self._queue.put(job_id)
+
+    def pause(self, job_id: str) -> None:
+        """Stop a queued or running job after its in-flight requests."""
+        with self._lock:
+            self._pause_requested.add(job_id)
+
+    def progress(self, job_id: str) -> Optional[JobProgress]:
+        with self._lock:
+            current = self._progress.get(job_id)
+            return replace(current) if current is not None else None
+
+    def snapshot(self) -> List[JobProgress]:
+        """Progress of every job seen by this worker, newest first."""
+        with self._lock:
+            return [replace(p) for p in reversed(list(self._progress.values()))]
+
+    def is_busy(self) -> bool:
+        with self._lock:
+            return any(p.state in ACTIVE_STATES for p in self._progress.values())
+
+    def _session(self, concurrency: int, hosts: int):
+        # Never hand out more workers than pooled connections, and keep a
+        # pool per host so endpoints of a pool do not evict each other's
+        key = (max(DEFAULT_POOL_SIZE, concurrency), hosts)
+        if key not in self._sessions:
+            self._sessions[key] = make_session(pool_size=key[0], hosts=hosts)
+        return self._sessions[key]
+
+    def _update(self, job_id: str, **changes) -> None:
+        with self._lock:
+            current = self._progress[job_id]
+            for name, value in changes.items():
+                setattr(current, name, value)
+
+    def _run(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                self._update(job_id, state=ERROR, error=str(e), finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job_id: str) -> None:
+        with self._lock:
+            if job_id in self._pause_requested:
+                self._progress[job_id].state = PAUSED
+                return
+        spec = self.journal.spec(job_id)
+        if spec.uses_prerender:
+            # Bodies are rendered here, so the send loop below only posts bytes
+            self._update(job_id, state=RENDERING)
+            self.journal.prerender(job_id)
+            with self._lock:
+                if job_id in self._pause_requested:
+                    self._progress[job_id].state = PAUSED
+                    return
+        self._update(job_id, state=RUNNING, started_at=time.time(), failed=0,
+                     completed_this_run=0)
+
+        results = run_job(self.journal, job_id, session=self._session(spec.concurrency, spec.hosts),
+                          metrics=self.metrics, ledger=self.ledger)
+        try:
+            for result in results:
+                with self._lock:
+                    current = self._progress[job_id]
+                    current.completed_this_run += 1
+                    if result.skipped:
+                        current.skipped += 1
+                    elif result.ok:
+                        current.sent += 1
+                    else:
+                        current.failed += 1
+                    if job_id in self._pause_requested:
+                        break
+        except JobError as e:
+            self._update(job_id, state=ERROR, error=str(e), finished_at=time.time())
+            return
+        finally:
+            # Flushes the final checkpoint
+            results.close()
+
+        counts = self.journal.counts(job_id)
+        self._update(
+            job_id,
+            state=DONE if counts[PENDING] == 0 else PAUSED,
+            sent=counts[SENT],
+            failed=counts[FAILED],
+            skipped=counts[SKIPPED],
+            finished_at=time.time(),
+        )
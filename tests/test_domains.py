@@ -0,0 +1,54 @@
+"""Domain screening resolves each domain once and caches final verdicts."""
+import pandas as pd
+
+from send_now.domains import DomainCache, DomainVerdict, StubResolver, screen_contacts
+
+
+def _contacts():
+    emails = [f"user{i}@{domain}" for i, domain in
+              enumerate(["example.com", "example.com", "dead.test", "example.org"])]
+    return pd.DataFrame({"name": [e.split("@")[0] for e in emails], "email": emails})
+
+
+def test_screening_drops_rejected_domains_and_caches_verdicts(tmp_path):
+    cache = DomainCache(str(tmp_path / "domains.sqlite3"))
+    resolver = StubResolver({"dead.test": False})
+
+    kept, stats, lookups = screen_contacts(_contacts(), resolver, cache)
+    assert lookups == 3
+    assert "dead.test" not in set(kept["email"].str.split("@").str[1])
+    assert len(kept) == 3
+    assert stats.iloc[0]["domain"] == "dead.test" and not stats.iloc[0]["accepted"]
+
+    kept_again, _, lookups = screen_contacts(_contacts(), resolver, cache)
+    assert lookups == 0
+    assert resolver.lookups == 3
+    assert kept_again.equals(kept)
+
+
+def test_expired_rejects_are_looked_up_again(tmp_path):
+    cache = DomainCache(str(tmp_path / "domains.sqlite3"), reject_ttl=0)
+    resolver = StubResolver({"dead.test": False})
+    screen_contacts(_contacts(), resolver, cache)
+
+    _, _, lookups = screen_contacts(_contacts(), resolver, cache)
+    assert lookups == 1
+    assert resolver.lookups == 4
+
+
+def test_transient_verdicts_are_not_cached(tmp_path):
+    cache = DomainCache(str(tmp_path / "domains.sqlite3"))
+    calls = []
+
+    def flaky(domain):
+        calls.append(domain)
+        return DomainVerdict(True, "lookup failed: Timeout", final=False)
+
+    kept, _, lookups = screen_contacts(_contacts(), flaky, cache)
+    assert lookups == 3
+    assert len(kept) == 4
+    assert cache.get_many(["example.com", "dead.test", "example.org"]) == {}
+
+    _, _, lookups = screen_contacts(_contacts(), flaky, cache)
+    assert lookups == 3
+    assert len(calls) == 6
@@ -0,0 +1,50 @@
+"""Template optimizer output."""
+from send_now.optimize import optimize_template
+
+
+def test_plain_comments_are_removed():
+    html = optimize_template("<p>Hi<!-- note --> {name}</p>").html
+    assert "note" not in html
+    assert "{name}" in html
+
+
+def test_outlook_conditional_comments_are_kept():
+    source = "<!--[if mso]><table><tr><td><![endif]--><p>Body</p><!--[if mso]></td></tr></table><![endif]-->"
+    html = optimize_template(source).html
+    assert "<!--[if mso]><table><tr><td><![endif]-->" in html
+    assert "<!--[if mso]></td></tr></table><![endif]-->" in html
+
+
+def test_downlevel_revealed_conditional_is_kept():
+    source = ("<body><!--[if !mso]><!--><div>For everyone else</div><!--<![endif]-->"
+              "<!-- drop me --><p>After</p></body>")
+    html = optimize_template(source).html
+    assert "<!--[if !mso]><!--><div>For everyone else</div><!--<![endif]-->" in html
+    assert "drop me" not in html
+    assert "<p>After</p>" in html
+
+
+def test_kept_hover_rule_beats_inlined_declaration():
+    source = ("<style>.cta a{background-color:#2b7de9}.cta a:hover{background-color:#1a5dbb}</style>"
+              '<div class="cta"><a href="#">Go</a></div>')
+    html = optimize_template(source).html
+    assert 'style="background-color:#2b7de9"' in html
+    assert ".cta a:hover{background-color:#1a5dbb!important}" in html
+
+
+def test_media_query_beats_inlined_declaration():
+    source = ("<style>.content{padding:40px;color:#333}"
+              "@media (max-width:600px){.content{padding:10px}.missing{margin:0}}</style>"
+              '<div class="content">Hi</div>')
+    html = optimize_template(source).html
+    assert 'style="padding:40px;color:#333"' in html
+    assert "@media (max-width:600px){.content{padding:10px!important}" in html
+    # The class stays, since the media query still refers to it
+    assert 'class="content"' in html
+
+
+def test_already_important_declarations_are_left_alone():
+    source = ("<style>p{color:red}@media (max-width:600px){p{color:blue !important}}</style>"
+              "<p>Hi</p>")
+    html = optimize_template(source).html
+    assert "important!important" not in html.replace(" ", "")
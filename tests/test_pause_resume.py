@@ -0,0 +1,117 @@
+"""Pausing, resuming and overlapping jobs send every recipient exactly once."""
+import time
+
+import pandas as pd
+
+from benchmarks.mock_webhook import MockWebhook
+from send_now.jobs import PENDING, SENT, SKIPPED, JobJournal, JobSpec, run_job
+from send_now.ledger import SendLedger, idempotency_key
+from send_now.templating import compile_template
+from send_now.worker import DONE, PAUSED, SendWorker
+
+RECIPIENTS = 200
+
+
+def _wait_for(worker, job_id, condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        progress = worker.progress(job_id)
+        if condition(progress):
+            return progress
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stuck at {worker.progress(job_id)}")
+
+
+def test_pause_and_resume_send_each_recipient_once(tmp_path):
+    server = MockWebhook(latency=0.2).start()
+    try:
+        journal = JobJournal(str(tmp_path / "jobs.sqlite3"))
+        ledger = SendLedger(str(tmp_path / "ledger.sqlite3"))
+        worker = SendWorker(journal, ledger=ledger)
+        contacts = pd.DataFrame({
+            "name": [f"Contact {i}" for i in range(RECIPIENTS)],
+            "email": [f"user{i}@example.com" for i in range(RECIPIENTS)],
+        })
+        spec = JobSpec(url=server.url, subject="Hello", template="<p>Hi {name}</p>",
+                       concurrency=8, max_attempts=1)
+        job_id = journal.create_job(spec, contacts)
+        template_id = compile_template(spec.template).template_id
+        keys = [idempotency_key(spec.campaign_name, template_id, email)
+                for email in contacts["email"]]
+
+        worker.submit(job_id)
+        _wait_for(worker, job_id, lambda p: p.done >= 10)
+        worker.pause(job_id)
+        paused = _wait_for(worker, job_id, lambda p: p.state == PAUSED)
+        # Requests under way at the pause were waited for and recorded
+        assert journal.counts(job_id)[SENT] == server.requests == paused.sent
+        assert journal.counts(job_id)[PENDING] > 0
+        # ...and settled, so no later job is granted them either
+        assert len(ledger.delivered(keys)) == paused.sent
+
+        worker.submit(job_id)
+        _wait_for(worker, job_id, lambda p: p.state == DONE)
+        assert journal.counts(job_id)[SENT] == RECIPIENTS
+        assert server.requests == RECIPIENTS
+        assert len(ledger.delivered(keys)) == RECIPIENTS
+    finally:
+        server.shutdown()
+
+
+def test_overlapping_job_after_pause_sends_what_the_paused_job_did_not(tmp_path):
+    server = MockWebhook(latency=0.2).start()
+    try:
+        journal = JobJournal(str(tmp_path / "jobs.sqlite3"))
+        ledger = SendLedger(str(tmp_path / "ledger.sqlite3"))
+        worker = SendWorker(journal, ledger=ledger)
+        contacts = pd.DataFrame({
+            "name": [f"Contact {i}" for i in range(RECIPIENTS)],
+            "email": [f"user{i}@example.com" for i in range(RECIPIENTS)],
+        })
+        spec = JobSpec(url=server.url, subject="Hello", template="<p>Hi {name}</p>",
+                       concurrency=8, max_attempts=1)
+        first = journal.create_job(spec, contacts)
+        worker.submit(first)
+        _wait_for(worker, first, lambda p: p.done >= 10)
+        worker.pause(first)
+        paused = _wait_for(worker, first, lambda p: p.state == PAUSED)
+
+        # The paused job let go of what it claimed but never sent
+        second = journal.create_job(spec, contacts)
+        worker.submit(second)
+        _wait_for(worker, second, lambda p: p.state == DONE)
+        counts = journal.counts(second)
+        assert counts[SKIPPED] == paused.sent
+        assert counts[SENT] == RECIPIENTS - paused.sent
+        assert server.requests == RECIPIENTS
+    finally:
+        server.shutdown()
+
+
+def test_recipients_claimed_by_another_job_stay_pending(tmp_path):
+    server = MockWebhook().start()
+    try:
+        journal = JobJournal(str(tmp_path / "jobs.sqlite3"))
+        ledger = SendLedger(str(tmp_path / "ledger.sqlite3"))
+        contacts = pd.DataFrame({
+            "name": [f"Contact {i}" for i in range(20)],
+            "email": [f"user{i}@example.com" for i in range(20)],
+        })
+        spec = JobSpec(url=server.url, subject="Hello", template="<p>Hi {name}</p>")
+        template_id = compile_template(spec.template).template_id
+        held = [idempotency_key(spec.campaign_name, template_id, email)
+                for email in contacts["email"][:5]]
+        ledger.claim("another-job", held)
+
+        job_id = journal.create_job(spec, contacts)
+        list(run_job(journal, job_id, ledger=ledger))
+        assert journal.counts(job_id)[SENT] == 15
+        assert journal.counts(job_id)[PENDING] == 5
+
+        # Once the other job lets go, a resume sends them
+        ledger.release("another-job")
+        list(run_job(journal, job_id, ledger=ledger))
+        assert journal.counts(job_id)[SENT] == 20
+        assert server.requests == 20
+    finally:
+        server.shutdown()
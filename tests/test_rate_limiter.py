@@ -0,0 +1,47 @@
+"""The rate limiter backs off on push-back and climbs back on success."""
+import time
+
+from send_now.sender import RateLimiter
+
+
+def test_push_back_halves_the_rate_once_per_second():
+    limiter = RateLimiter(rate=100)
+    limiter.penalize()
+    assert limiter.rate == 50
+    # Requests rejected together are one congestion signal
+    limiter.penalize()
+    assert limiter.rate == 50
+
+
+def test_successes_climb_back_to_the_ceiling():
+    limiter = RateLimiter(rate=100)
+    limiter.penalize()
+    limiter.reward()
+    assert 50 < limiter.rate < 100
+    for _ in range(1000):
+        limiter.reward()
+    assert limiter.rate == 100
+
+
+def test_without_a_ceiling_the_limit_is_learned_and_then_lifted():
+    limiter = RateLimiter()
+    assert limiter.rate is None
+    for _ in range(10):
+        limiter.acquire()
+    limiter.penalize()
+    learned = limiter._learned_rate
+    assert learned >= 2 * limiter.min_rate
+    assert limiter.rate == learned / 2
+    for _ in range(1000):
+        limiter.reward()
+        if limiter.rate is None:
+            break
+    assert limiter.rate is None
+
+
+def test_retry_after_pauses_every_sender():
+    limiter = RateLimiter(rate=1000)
+    limiter.penalize(retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.19
@@ -0,0 +1,69 @@
+"""Batched sends map the webhook's per-recipient answers back to recipients."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from send_now.sender import post_batch
+
+PAYLOADS = [{"email": f"user{i}@example.com", "name": f"User {i}"} for i in range(3)]
+KEYS = ["a", "b", "c"]
+
+
+class _CannedHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status, body = self.server.reply
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _CannedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, status, body):
+    server.reply = (status, body)
+    return post_batch(f"http://127.0.0.1:{server.server_address[1]}/", KEYS, PAYLOADS)
+
+
+def test_results_are_matched_by_email(webhook):
+    results = _post(webhook, 200, {"results": [
+        {"email": "user2@example.com", "ok": False, "error": "bounced"},
+        {"email": "user0@example.com", "ok": True},
+    ]})
+    assert [r.key for r in results] == KEYS
+    assert [r.ok for r in results] == [True, True, False]
+    assert results[2].error == "bounced"
+    # No entry for user1: it inherits the batch's status
+    assert results[1].status_code == 200
+
+
+def test_results_are_matched_by_position(webhook):
+    results = _post(webhook, 200, [{"success": True}, {"status": 422}, {"error": "blocked"}])
+    assert [r.ok for r in results] == [True, False, False]
+    assert results[1].status_code == 422
+    assert results[2].error == "blocked"
+
+
+def test_unmatched_or_failed_batches_apply_to_every_recipient(webhook):
+    # A positional list of the wrong length cannot be trusted
+    results = _post(webhook, 200, [{"ok": False}])
+    assert all(r.ok for r in results)
+
+    results = _post(webhook, 400, {"error": "bad request"})
+    assert not any(r.ok for r in results)
+    assert {r.status_code for r in results} == {400}
@@ -0,0 +1,56 @@
+"""Sheet sync sends only new and changed rows."""
+import pandas as pd
+
+from benchmarks.mock_webhook import MockWebhook
+from send_now.sender import RetryPolicy
+from send_now.sheets import SheetSync, SyncManifest
+
+ROWS = 50_000
+
+
+def _contacts():
+    return pd.DataFrame({"name": [f"User {i}" for i in range(ROWS)],
+                         "email": [f"user{i}@example.com" for i in range(ROWS)]})
+
+
+def test_resync_sends_only_changed_rows(tmp_path):
+    server = MockWebhook().start()
+    try:
+        sync = SheetSync(server.url, SyncManifest(str(tmp_path / "manifest.sqlite3")))
+        df = _contacts()
+
+        report = sync.sync(df)
+        assert (report.appended, report.updated, report.failed) == (ROWS, 0, 0)
+        assert report.requests == server.requests == ROWS // 500
+
+        report = sync.sync(df)
+        assert (report.sent, report.unchanged, report.requests) == (0, ROWS, 0)
+
+        df.loc[df.index[::5000], "name"] = "Renamed"
+        df = pd.concat([df, pd.DataFrame({"name": ["New"], "email": ["new@example.com"]})],
+                       ignore_index=True)
+        before = server.requests
+        report = sync.sync(df)
+        assert (report.appended, report.updated, report.unchanged) == (1, 10, ROWS - 10)
+        assert server.requests - before == report.requests == 2
+    finally:
+        server.shutdown()
+
+
+def test_failed_batches_are_sent_again(tmp_path):
+    manifest = SyncManifest(str(tmp_path / "manifest.sqlite3"))
+    df = _contacts().head(1000)
+
+    failing = MockWebhook(error_rate=1.0).start()
+    try:
+        report = SheetSync(failing.url, manifest, retry=RetryPolicy(max_attempts=1)).sync(df)
+        assert (report.sent, report.failed) == (0, 1000)
+    finally:
+        failing.shutdown()
+
+    server = MockWebhook().start()
+    try:
+        report = SheetSync(server.url, manifest).sync(df)
+        assert (report.appended, report.failed) == (1000, 0)
+    finally:
+        server.shutdown()